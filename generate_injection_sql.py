@@ -5,10 +5,58 @@ from tools.j2_opeartion import *
 import re
 import random
 from typing import Dict, List, Any
+from dataclasses import dataclass, field
+from enum import Enum
+from functools import lru_cache
 from datetime import time
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import string
-import pymysql
+import json
+import hashlib
+import struct
+from array import array
+import multiprocessing
+from multiprocessing import Pool, shared_memory
+import os
+import glob
+import argparse
+import sys
+import shutil
+import subprocess
+import tempfile
+import threading
+from time import monotonic, sleep
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from queue import Queue, Empty
+from collections import deque
+import sqlite3
+
+try:
+    import pymysql
+except ImportError:  # 仅使用 MySQL 样本后端时需要
+    pymysql = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 仅导出 Parquet 时需要
+    pa = None
+    pq = None
+
+try:
+    import sqlglot
+    from sqlglot import exp as sqlglot_exp
+    from sqlglot.errors import SqlglotError
+except ImportError:  # 仅用解析器校验生成的 SQL 时需要
+    sqlglot = None
+    sqlglot_exp = None
+    SqlglotError = None
+
+try:
+    from time import clock_gettime, pthread_getcpuclockid
+except ImportError:  # 非 Unix 平台无法读取线程 CPU 时间，性能分析只统计墙钟时间
+    clock_gettime = None
+    pthread_getcpuclockid = None
 
 class SymbolChecker:
     def __init__(self):
@@ -75,16 +123,16 @@ class SymbolChecker:
 
 class GetRandomAttribute:
     @staticmethod
-    def random_time() -> str:
+    def random_time(rng=random) -> str:
         """生成随机时间（HH:MM:SS）"""
-        hour = random.randint(0, 23)
-        minute = random.randint(0, 59)
-        second = random.randint(0, 59)
+        hour = rng.randint(0, 23)
+        minute = rng.randint(0, 59)
+        second = rng.randint(0, 59)
         return f"{hour:02d}:{minute:02d}:{second:02d}"
 
     @staticmethod
     def random_date(start_date: date | None = None,
-                    end_date: date | None = None) -> str:
+                    end_date: date | None = None, rng=random) -> str:
         """生成 start_date 和 end_date 之间的随机日期，格式 YYYY-MM-DD"""
         if start_date is None:
             start_date = date(2000, 1, 1)
@@ -95,60 +143,1027 @@ class GetRandomAttribute:
             raise ValueError("start_date 不能晚于 end_date")
 
         delta = end_date - start_date
-        random_days = random.randint(0, delta.days)
+        random_days = rng.randint(0, delta.days)
         random_date = start_date + timedelta(days=random_days)
         return random_date.strftime('%Y-%m-%d')
 
     @staticmethod
-    def random_hex_number() -> str:
+    def random_hex_number(rng=random) -> str:
         """生成随机十六进制数（字符串形式，如 0x1a2b3c）"""
-        return hex(random.randint(0, 0xFFFFFFFF))
+        return hex(rng.randint(0, 0xFFFFFFFF))
 
     @staticmethod
-    def random_int_number(min_value: int = 0, max_value: int = 100) -> int:
+    def random_int_number(min_value: int = 0, max_value: int = 100, rng=random) -> int:
         """生成随机整数"""
-        return str(random.randint(min_value, max_value))
+        return str(rng.randint(min_value, max_value))
 
     @staticmethod
     def random_float_number(min_value: float = 0.0,
                             max_value: float = 10.0,
-                            ndigits: int = 2) -> float:
+                            ndigits: int = 2, rng=random) -> float:
         """生成随机浮点数，保留 ndigits 位小数"""
-        value = random.uniform(min_value, max_value)
+        value = rng.uniform(min_value, max_value)
         return str(round(value, ndigits))
 
     @staticmethod
-    def random_character() -> str:
+    def random_character(rng=random) -> str:
         """生成随机字符（英文字母）"""
-        return random.choice(string.ascii_letters)
+        return rng.choice(string.ascii_letters)
   
+@dataclass(slots=True)
+class Placeholder:
+    """模板中的一个占位符"""
+    full_match: str
+    start: int
+    end: int
+    type: str = 'unknown'
+    table_id: str | None = None
+    column_id: str | None = None
+    content: str | None = None
+    expected_type: str = 'all'
+
+@dataclass(slots=True)
+class TableAssignment:
+    """某个表ID分配到的实际表及其列信息"""
+    table: str
+    columns: List[str]
+    types: Dict[str, str]
+    samples: Dict[str, str]  # 只包含已用到的列，按需填充
+    type_constraints: Dict[str, str]
+    filtered_columns: Dict[str, List[str]]
+    column_map: Dict[str, str] = field(default_factory=dict)
+
+@dataclass(slots=True)
+class FillPlan:
+    """
+    一次模板填充的中间状态
+    
+    填充分为三步：prepare（CPU，选表选列）→ fetch_samples（I/O，读取样本）→ render（CPU，替换占位符）
+    """
+    template: str
+    information_features: str | None = None
+    placeholders: List[Placeholder] = field(default_factory=list)
+    table_assignments: Dict[str, TableAssignment] = field(default_factory=dict)
+    sample_requests: Dict[str, List[str]] = field(default_factory=dict)  # {table: [column, ...]}
+    system_information: str | None = None  # $sample$ 需要查询的系统信息
+    sample_value: str | None = None
+    fallback_count: int = 0  # 读取失败、用 NULL/空值兜底的次数
+    verbose: bool = True  # 逐条打印读取失败等警告；关闭时只计入 run_stats
+    rng: Any = random  # 本次填充的随机数生成器（见 GenerationJob.rng）
+
+@dataclass(slots=True)
+class InjectionExample:
+    """
+    生成的注入样本
+    
+    只通过下标引用原始SQL和载荷模板，完整数据在 to_dict 序列化时才展开。
+    """
+    sql: str
+    original_sql_id: int
+    payload_template_id: int
+    payload: str
+    label: bool
+    comment: bool
+    difficulty: str | None
+    sample_fallback: bool = False  # 是否有样本因读取失败而用 NULL/空值兜底
+    
+    def to_dict(self, raw_sqls: List[Dict], payloads: List[Dict]) -> Dict[str, Any]:
+        """
+        展开为完整的样本字典
+        
+        Args:
+            raw_sqls: 生成时使用的原始SQL列表
+            payloads: 生成时使用的载荷模板列表
+        """
+        return {
+            "sql": self.sql,
+            "original_sql": raw_sqls[self.original_sql_id],
+            "payload_template": payloads[self.payload_template_id],
+            "payload": self.payload,
+            "label": self.label,
+            "comment": self.comment,
+            "difficulty": self.difficulty,
+            "sample_fallback": self.sample_fallback
+        }
+
+class ColumnTypeCategory(Enum):
+    """列类型类别"""
+    NUMBER = 'number'
+    STRING = 'string'
+    DATE = 'date'
+    BOOLEAN = 'boolean'
+    OTHER = 'other'
+
+# 基础类型名 → 类别；基础类型名为去掉长度/精度和修饰词后的第一个词
+_BASE_TYPE_CATEGORIES = {
+    **dict.fromkeys(['int', 'integer', 'bigint', 'smallint', 'tinyint', 'mediumint',
+                     'real', 'float', 'double', 'numeric', 'decimal', 'dec', 'fixed'],
+                    ColumnTypeCategory.NUMBER),
+    **dict.fromkeys(['varchar', 'char', 'character', 'text', 'tinytext', 'mediumtext', 'longtext',
+                     'nvarchar', 'nchar', 'clob', 'blob', 'tinyblob', 'mediumblob', 'longblob',
+                     'string', 'enum', 'set'],
+                    ColumnTypeCategory.STRING),
+    **dict.fromkeys(['date', 'datetime', 'timestamp', 'time', 'year'],
+                    ColumnTypeCategory.DATE),
+    **dict.fromkeys(['bool', 'boolean', 'bit'],
+                    ColumnTypeCategory.BOOLEAN),
+}
+
+@lru_cache(maxsize=None)
+def classify_column_type(raw_type: str) -> ColumnTypeCategory:
+    """
+    将原始列类型归一化为类型类别，按原始字符串缓存
+    
+    例如 varchar(255)、decimal(10,2)、int unsigned、longtext
+    """
+    base_type = re.split(r'[\s(]', raw_type.strip().lower(), maxsplit=1)[0]
+    return _BASE_TYPE_CATEGORIES.get(base_type, ColumnTypeCategory.OTHER)
+
+class SharedSampleStore:
+    """
+    只读共享内存样本库
+
+    将列取值池和系统变量取值一次性写入一块共享内存，多个工作进程按名字挂载后
+    直接读取，不再各自持有一份样本副本。
+
+    内存布局:
+    - 头部: magic(4B) + 索引长度(8B) + 取值总数(8B)
+    - 索引: JSON {key: [首个取值序号, 取值个数]}，按 8 字节对齐
+    - 偏移表: (取值总数 + 1) 个 uint64，第 i 个取值位于 [offsets[i], offsets[i+1])
+    - 数据区: 所有取值的 UTF-8 编码首尾相接
+    """
+
+    MAGIC = b'SSS1'
+    HEADER = struct.Struct('<4sQQ')
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False):
+        self._shm = shm
+        self._owner = owner
+
+        buf = shm.buf
+        magic, index_len, value_count = self.HEADER.unpack_from(buf, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"共享内存块 {shm.name} 不是样本库格式")
+
+        pos = self.HEADER.size
+        self._index = json.loads(bytes(buf[pos:pos + index_len]).decode('utf-8'))
+        pos += self._align(index_len)
+        self._offsets = buf[pos:pos + 8 * (value_count + 1)].cast('Q')
+        self._data = buf[pos + 8 * (value_count + 1):]
+
+    @staticmethod
+    def _align(size: int) -> int:
+        return (size + 7) & ~7
+
+    @staticmethod
+    def column_key(db_name: str, table: str, column: str) -> str:
+        """列取值池的键"""
+        return f"column:{db_name}.{table}.{column}"
+
+    @staticmethod
+    def sysinfo_key(db_name: str, system_information: str) -> str:
+        """系统变量在某个数据库中的取值的键（DATABASE() 等取值与当前数据库有关）"""
+        return f"sysinfo:{db_name}:{system_information}"
+
+    @classmethod
+    def publish(cls, pools: Dict[str, List[str]]) -> 'SharedSampleStore':
+        """
+        将取值池写入新建的共享内存块
+
+        Args:
+            pools: {key: [取值, ...]}
+
+        Returns:
+            持有该共享内存块的样本库（负责最终 unlink）
+        """
+        index = {}
+        encoded_values = []
+        for key, values in pools.items():
+            index[key] = [len(encoded_values), len(values)]
+            encoded_values.extend(str(value).encode('utf-8') for value in values)
+
+        offsets = array('Q', [0])
+        for value in encoded_values:
+            offsets.append(offsets[-1] + len(value))
+
+        index_bytes = json.dumps(index, ensure_ascii=False).encode('utf-8')
+        index_size = cls._align(len(index_bytes))
+        offsets_bytes = offsets.tobytes()
+        total_size = cls.HEADER.size + index_size + len(offsets_bytes) + offsets[-1]
+
+        shm = shared_memory.SharedMemory(create=True, size=total_size)
+        buf = shm.buf
+        cls.HEADER.pack_into(buf, 0, cls.MAGIC, len(index_bytes), len(encoded_values))
+        pos = cls.HEADER.size
+        buf[pos:pos + len(index_bytes)] = index_bytes
+        pos += index_size
+        buf[pos:pos + len(offsets_bytes)] = offsets_bytes
+        pos += len(offsets_bytes)
+        for value in encoded_values:
+            buf[pos:pos + len(value)] = value
+            pos += len(value)
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedSampleStore':
+        """按名字挂载已发布的样本库（只读）"""
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def _value_at(self, position: int) -> str:
+        return bytes(self._data[self._offsets[position]:self._offsets[position + 1]]).decode('utf-8')
+
+    def values(self, key: str) -> List[str]:
+        """返回某个键下的所有取值"""
+        if key not in self._index:
+            return []
+        first, count = self._index[key]
+        return [self._value_at(first + i) for i in range(count)]
+
+    def choice(self, key: str, rng=random) -> str | None:
+        """从某个键下随机取一个值，只解码被选中的那一个"""
+        if key not in self._index:
+            return None
+        first, count = self._index[key]
+        if count == 0:
+            return None
+        return self._value_at(first + rng.randrange(count))
+
+    def close(self):
+        """释放映射；发布方同时删除共享内存块"""
+        self._offsets.release()
+        self._data.release()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+class RunStats:
+    """生成过程中的计数器（线程安全）"""
+    
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+    
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+    
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+    
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+    
+    def merge(self, counters: Dict[str, int]):
+        """累加其他进程的计数"""
+        with self._lock:
+            for name, amount in counters.items():
+                self._counters[name] = self._counters.get(name, 0) + amount
+
+run_stats = RunStats()
+
+class DatabaseUnavailableError(Exception):
+    """数据库熔断中，或重试后仍无法访问"""
+
+class CircuitBreaker:
+    """
+    单个数据库的熔断器
+    
+    连续失败 failure_threshold 次后熔断，reset_timeout 秒内拒绝所有访问；
+    之后放行一次试探，成功则恢复，失败则重新熔断。
+    """
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = monotonic()
+    
+    def release_trial(self):
+        """试探因与数据库无关的原因中断时放弃本次试探，下次访问重新试探"""
+        with self._lock:
+            self._trial_in_flight = False
+
+class MySQLAccess:
+    """
+    带超时、有限次重试（指数退避）和按数据库熔断的 MySQL 访问层
+    
+    连接类错误会重试，重试耗尽或熔断时抛出 DatabaseUnavailableError，
+    由调用方暂停该数据库的生成，而不是用 NULL 兜底。权限、认证和数据库不存在的错误
+    不重试，直接计入熔断并抛出 DatabaseUnavailableError。SQL 本身的错误不重试，原样抛出。
+    """
+    
+    # pymysql 对未单独映射的服务器错误（如 1054 未知列、1193 未知系统变量）也抛 OperationalError，
+    # 因此按错误码区分：2000 以上是客户端/连接错误，另外加上连接数已满和服务器正在关闭
+    TRANSIENT_SERVER_ERRNOS = {1040, 1053}
+    # 无权访问数据库、登录失败、数据库不存在：重试没有意义，但同样说明该数据库无法使用
+    UNAVAILABLE_SERVER_ERRNOS = {1044, 1045, 1049}
+    
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+    
+    def __init__(self, mysql_config: Dict[str, Any], breaker_key: str,
+                 connect_timeout: float = 5, read_timeout: float = 30, write_timeout: float = 30,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0):
+        """
+        Args:
+            mysql_config: MySQL配置字典
+            breaker_key: 熔断器的键，通常为数据库名
+            connect_timeout / read_timeout / write_timeout: 超时（秒）
+            max_retries: 连接类错误的最大重试次数
+            backoff_base / backoff_max: 退避时间的基数和上限（秒）
+        """
+        self.mysql_config = mysql_config
+        self.breaker_key = breaker_key
+        self.connect_timeout = mysql_config.get('connect_timeout', connect_timeout)
+        self.read_timeout = mysql_config.get('read_timeout', read_timeout)
+        self.write_timeout = mysql_config.get('write_timeout', write_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        
+        with self._breakers_lock:
+            self.breaker = self._breakers.setdefault(breaker_key, CircuitBreaker())
+    
+    @staticmethod
+    def _errno(error: BaseException) -> int | None:
+        """pymysql 错误的错误码，其他异常返回 None"""
+        if pymysql is None or not isinstance(error, pymysql.err.MySQLError):
+            return None
+        return error.args[0] if error.args and isinstance(error.args[0], int) else None
+    
+    @classmethod
+    def is_transient(cls, error: BaseException) -> bool:
+        """是否为值得重试的连接类错误（SQL 本身的错误返回 False）"""
+        if isinstance(error, OSError):
+            return True
+        if pymysql is not None and isinstance(error, pymysql.err.InterfaceError):
+            return True
+        errno = cls._errno(error)
+        return errno is not None and (errno >= 2000 or errno in cls.TRANSIENT_SERVER_ERRNOS)
+    
+    @classmethod
+    def is_unavailable(cls, error: BaseException) -> bool:
+        """是否为不必重试、但说明数据库无法使用的错误（权限、认证、数据库不存在）"""
+        return cls._errno(error) in cls.UNAVAILABLE_SERVER_ERRNOS
+    
+    def connect(self):
+        """创建带超时的MySQL连接"""
+        return pymysql.connect(
+            host=self.mysql_config['host'],
+            port=self.mysql_config['port'],
+            user=self.mysql_config['user'],
+            password=self.mysql_config['password'],
+            database=self.mysql_config['database'],
+            charset=self.mysql_config.get('charset', 'utf8mb4'),
+            cursorclass=pymysql.cursors.DictCursor,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            write_timeout=self.write_timeout
+        )
+    
+    def run(self, operation):
+        """
+        在新连接上执行 operation(cursor) 并返回其结果
+        
+        SQL 本身的错误说明服务器可以正常应答，对熔断器计为成功后原样抛出。
+        
+        Raises:
+            DatabaseUnavailableError: 熔断中、重试耗尽，或无权访问该数据库
+        """
+        if not self.breaker.allow():
+            run_stats.increment('db_circuit_open')
+            raise DatabaseUnavailableError(f"数据库 {self.breaker_key} 熔断中")
+        
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                run_stats.increment('db_retries')
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                sleep(delay * random.uniform(0.5, 1.0))
+            connection = None
+            try:
+                connection = self.connect()
+                with connection.cursor() as cursor:
+                    result = operation(cursor)
+                self.breaker.record_success()
+                return result
+            except BaseException as e:
+                if self.is_transient(e):
+                    last_error = e
+                    continue
+                if self.is_unavailable(e):
+                    self.breaker.record_failure()
+                    run_stats.increment('db_failures')
+                    raise DatabaseUnavailableError(f"数据库 {self.breaker_key} 不可用: {e}") from e
+                # 无论如何都要结束熔断器的试探，否则该数据库会一直被拒绝
+                if pymysql is not None and isinstance(e, pymysql.err.MySQLError):
+                    self.breaker.record_success()
+                else:
+                    self.breaker.release_trial()
+                raise
+            finally:
+                if connection:
+                    connection.close()
+        
+        self.breaker.record_failure()
+        run_stats.increment('db_failures')
+        raise DatabaseUnavailableError(f"数据库 {self.breaker_key} 不可用: {last_error}") from last_error
+
+def synthetic_column_value(data_type: str) -> str:
+    """按列类型生成一个随机值，用于没有种子数据的本地样本后端"""
+    category = classify_column_type(data_type)
+    if category is ColumnTypeCategory.NUMBER:
+        return GetRandomAttribute.random_int_number(0, 1000)
+    if category is ColumnTypeCategory.DATE:
+        return GetRandomAttribute.random_date()
+    if category is ColumnTypeCategory.BOOLEAN:
+        return random.choice(['0', '1'])
+    return ''.join(GetRandomAttribute.random_character() for _ in range(random.randint(3, 12)))
+
+def synthetic_system_values(system_vars: List[Dict[str, Any]]) -> Dict[str, str]:
+    """为系统变量生成替代值（integer 类型为整数，其余为字符串）"""
+    return {
+        info['variable']: GetRandomAttribute.random_int_number(0, 65535) if info.get('type') == 'integer'
+        else ''.join(GetRandomAttribute.random_character() for _ in range(8))
+        for info in system_vars
+    }
+
+class SampleBackend:
+    """
+    样本后端接口：填充器通过它读取表中的样本值和系统信息
+    
+    无法访问时抛出 DatabaseUnavailableError（调用方跳过样本）；
+    表、列或语句本身有问题时抛出其它异常（调用方用 NULL 兜底）。
+    """
+    
+    key = None  # 区分不同后端实例的键，同一后端上同一数据库共用一个蓄水池
+    
+    def sample_columns(self, db_name: str, requests: Dict[str, List[str]], probes: int, batch_size: int) -> Dict[str, Dict[str, List[Any]]]:
+        """
+        对每个表随机读取 probes 段、每段至多 batch_size 行
+        
+        Returns:
+            {table: {column: [值, ...]}}
+        """
+        raise NotImplementedError
+    
+    def system_value(self, db_name: str, expression: str) -> Any:
+        """读取系统信息（变量、函数或完整 SELECT 语句）的值，没有结果时返回 None"""
+        raise NotImplementedError
+    
+    def explain(self, db_name: str, sqls: List[str]) -> List[str | None]:
+        """
+        在数据库上逐条 EXPLAIN（不执行），用于校验生成的 SQL
+        
+        Returns:
+            每条 SQL 的错误信息，可以执行的为 None
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支持 EXPLAIN 校验")
+    
+    def ping(self, db_name: str):
+        """检查后端可以访问，失败时抛出异常"""
+    
+    def describe(self, db_name: str) -> str:
+        return f"{type(self).__name__}/{db_name}"
+
+class PyMySQLBackend(SampleBackend):
+    """
+    MySQL 样本后端
+    
+    有单列整数主键的表在主键区间内随机取起点读一小段，否则按估算行数随机 OFFSET 读一小段；
+    同一次请求的所有表合并为一条 UNION ALL 语句，只需一次往返。
+    每个数据库使用一个 MySQLAccess（超时、重试、熔断）。
+    """
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    def __init__(self, mysql_config: Dict[str, Any]):
+        if pymysql is None:
+            raise ImportError("MySQL 样本后端需要安装 pymysql")
+        self.mysql_config = mysql_config
+        self.key = ('pymysql', mysql_config.get('host'), mysql_config.get('port'), mysql_config.get('user'))
+        self._access = {}
+        self._table_meta = {}  # {(db, table): 主键区间或估算行数}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def for_config(cls, mysql_config: Dict[str, Any]) -> 'PyMySQLBackend':
+        """同一 MySQL 服务器共用一个后端（以及其中缓存的表元数据）"""
+        key = ('pymysql', mysql_config.get('host'), mysql_config.get('port'), mysql_config.get('user'))
+        with cls._instances_lock:
+            backend = cls._instances.get(key)
+            if backend is None:
+                backend = cls(mysql_config)
+                cls._instances[key] = backend
+            return backend
+    
+    def access(self, db_name: str | None) -> MySQLAccess:
+        db_name = db_name or self.mysql_config['database']
+        with self._lock:
+            access = self._access.get(db_name)
+            if access is None:
+                access = MySQLAccess(dict(self.mysql_config, database=db_name), db_name)
+                self._access[db_name] = access
+            return access
+    
+    def _load_table_meta(self, cursor, db_name: str, tables: List[str]):
+        """
+        一次查询所有表的主键和估算行数，再用一次 UNION 查询单列整数主键的区间；
+        没有单列整数主键的表退化为按估算行数随机 OFFSET
+        """
+        placeholders = ', '.join(['%s'] * len(tables))
+        cursor.execute(
+            "SELECT t.TABLE_NAME AS table_name, t.TABLE_ROWS AS table_rows, "
+            "k.COLUMN_NAME AS pk_column, c.DATA_TYPE AS pk_type "
+            "FROM information_schema.TABLES t "
+            "LEFT JOIN information_schema.KEY_COLUMN_USAGE k ON k.TABLE_SCHEMA = t.TABLE_SCHEMA "
+            "AND k.TABLE_NAME = t.TABLE_NAME AND k.CONSTRAINT_NAME = 'PRIMARY' "
+            "LEFT JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = k.TABLE_SCHEMA "
+            "AND c.TABLE_NAME = k.TABLE_NAME AND c.COLUMN_NAME = k.COLUMN_NAME "
+            f"WHERE t.TABLE_SCHEMA = %s AND t.TABLE_NAME IN ({placeholders})",
+            (db_name, *tables)
+        )
+        rows_by_table = {}
+        pk_by_table = {}
+        for row in cursor.fetchall():
+            rows_by_table[row['table_name']] = int(row['table_rows'] or 0)
+            if row['pk_column'] is not None:
+                pk_by_table.setdefault(row['table_name'], []).append(row)
+        
+        for table in tables:
+            self._table_meta[(db_name, table)] = {'pk': None, 'rows': rows_by_table.get(table, 0)}
+        
+        pk_tables = {
+            table: pk_rows[0]['pk_column'] for table, pk_rows in pk_by_table.items()
+            if len(pk_rows) == 1 and classify_column_type(pk_rows[0]['pk_type']) is ColumnTypeCategory.NUMBER
+        }
+        if not pk_tables:
+            return
+        cursor.execute(" UNION ALL ".join(
+            f"(SELECT {self._quote_literal(table)} AS _table, MIN(`{pk}`) AS lo, MAX(`{pk}`) AS hi "
+            f"FROM `{db_name}`.`{table}`)"
+            for table, pk in pk_tables.items()
+        ))
+        for bounds in cursor.fetchall():
+            if bounds['lo'] is not None:
+                self._table_meta[(db_name, bounds['_table'])] = {
+                    'pk': pk_tables[bounds['_table']], 'lo': int(bounds['lo']), 'hi': int(bounds['hi'])
+                }
+    
+    @staticmethod
+    def _quote_literal(value: str) -> str:
+        escaped = value.replace("\\", "\\\\").replace("'", "''")
+        return f"'{escaped}'"
+    
+    def _probe_sql(self, db_name: str, table: str, columns: List[str], width: int, batch_size: int) -> str:
+        """
+        生成一次随机读取的子查询，只包含需要的列
+        
+        结果统一为 (_table, c0, c1, ...) 的形状，不足 width 的列补 NULL，便于 UNION ALL 合并多个表
+        """
+        meta = self._table_meta[(db_name, table)]
+        select_list = [f"{self._quote_literal(table)} AS _table"]
+        select_list += [f"CAST(`{col}` AS CHAR) AS c{i}" for i, col in enumerate(columns)]
+        select_list += [f"NULL AS c{i}" for i in range(len(columns), width)]
+        select_str = ', '.join(select_list)
+        if meta['pk'] is not None:
+            start = random.randint(meta['lo'], meta['hi'])
+            return (f"(SELECT {select_str} FROM `{db_name}`.`{table}` "
+                    f"WHERE `{meta['pk']}` >= {start} ORDER BY `{meta['pk']}` LIMIT {batch_size})")
+        offset = random.randint(0, max(meta['rows'] - batch_size, 0))
+        return f"(SELECT {select_str} FROM `{db_name}`.`{table}` LIMIT {batch_size} OFFSET {offset})"
+    
+    def sample_columns(self, db_name, requests, probes, batch_size):
+        def _operation(cursor):
+            missing_meta = [table for table in requests if (db_name, table) not in self._table_meta]
+            if missing_meta:
+                self._load_table_meta(cursor, db_name, missing_meta)
+            width = max(len(columns) for columns in requests.values())
+            cursor.execute(" UNION ALL ".join(
+                self._probe_sql(db_name, table, columns, width, batch_size)
+                for table, columns in requests.items()
+                for _ in range(probes)
+            ))
+            return cursor.fetchall()
+        
+        # 将 UNION 结果按表拆回各列
+        samples = {table: {col: [] for col in columns} for table, columns in requests.items()}
+        for row in self.access(db_name).run(_operation):
+            for i, col in enumerate(requests.get(row['_table'], [])):
+                samples[row['_table']][col].append(row.get(f'c{i}'))
+        return samples
+    
+    def system_value(self, db_name, expression):
+        # 如果不包含SELECT，添加SELECT前缀
+        if "SELECT" not in expression.upper():
+            sql = f"SELECT {expression}"
+        else:
+            sql = expression
+        
+        def _operation(cursor):
+            cursor.execute(sql)
+            return cursor.fetchone()
+        
+        result = self.access(db_name).run(_operation)
+        if result is None:
+            return None
+        # 如果是字典类型（DictCursor），获取第一个值
+        if isinstance(result, dict):
+            return next(iter(result.values())) if result else None
+        # 如果是元组类型
+        if isinstance(result, tuple):
+            return result[0]
+        return result
+    
+    def explain(self, db_name, sqls):
+        def _operation(cursor):
+            errors = []
+            for sql in sqls:
+                try:
+                    cursor.execute(f"EXPLAIN {sql}")
+                    cursor.fetchall()
+                    errors.append(None)
+                except pymysql.err.MySQLError as e:
+                    # 连接类错误交给 MySQLAccess 重试
+                    if MySQLAccess.is_transient(e):
+                        raise
+                    errors.append(str(e))
+            return errors
+        
+        return self.access(db_name).run(_operation)
+    
+    def ping(self, db_name):
+        self.access(db_name).connect().close()
+    
+    def describe(self, db_name):
+        return f"MySQL {self.mysql_config['host']}:{self.mysql_config['port']}/{db_name or self.mysql_config['database']}"
+
+class SQLiteBackend(SampleBackend):
+    """
+    嵌入式 SQLite 样本后端，用于不依赖 MySQL 服务器的本地运行和测试
+    
+    按 schema.json 在内存中建表（每个表命名为 "数据库.表"），写入种子数据；
+    没有种子数据的表按列类型生成 synthetic_rows 行随机数据。
+    系统信息先查 system_values，没有时交给 SQLite 计算（如 SELECT 1）。
+    """
+    
+    def __init__(self, schemas: List[Dict], seed_rows: Dict[str, Dict[str, List[Dict]]] | None = None,
+                 system_values: Dict[str, Any] | None = None, synthetic_rows: int = 50):
+        """
+        Args:
+            schemas: 与 schema.json 相同格式的数据库模式列表
+            seed_rows: {数据库: {表: [{列: 值}, ...]}}
+            system_values: {系统信息: 值}
+            synthetic_rows: 没有种子数据的表生成的行数
+        """
+        self.key = ('sqlite', id(self))
+        self.system_values = dict(system_values or {})
+        self._connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self._lock = threading.Lock()
+        seed_rows = seed_rows or {}
+        with self._lock:
+            for schema in schemas:
+                db_name = schema.get('database_name', 'unknown')
+                for table in schema.get('tables', []):
+                    self._create_table(db_name, table, seed_rows.get(db_name, {}).get(table['table_name']), synthetic_rows)
+            self._connection.commit()
+    
+    @classmethod
+    def from_files(cls, schema_paths: List[str], seed_path: str | None = None,
+                   system_vars: List[Dict[str, Any]] | None = None, synthetic_rows: int = 50) -> 'SQLiteBackend':
+        """
+        从 schema.json 等模式文件和可选的种子文件（{"tables": {数据库: {表: [行, ...]}}, "system_values": {...}}）创建
+        
+        种子文件中没有的系统变量按 system_vars 的类型生成替代值
+        """
+        seed = read_json_file(seed_path) if seed_path else {}
+        system_values = synthetic_system_values(system_vars or [])
+        system_values.update(seed.get('system_values', {}))
+        schemas = [schema for schema_path in schema_paths for schema in read_json_file(schema_path)]
+        return cls(schemas, seed.get('tables'), system_values, synthetic_rows)
+    
+    @staticmethod
+    def _quote(identifier: str) -> str:
+        return '"' + identifier.replace('"', '""') + '"'
+    
+    def _create_table(self, db_name: str, table: Dict[str, Any], rows: List[Dict] | None, synthetic_rows: int):
+        columns = table.get('columns', [])
+        if not columns:
+            return
+        name = self._quote(f"{db_name}.{table['table_name']}")
+        column_defs = ', '.join(
+            f"{self._quote(col['column_name'])} {'NUMERIC' if classify_column_type(col['data_type']) is ColumnTypeCategory.NUMBER else 'TEXT'}"
+            for col in columns
+        )
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS {name} ({column_defs})")
+        if rows is None:
+            rows = [{col['column_name']: synthetic_column_value(col['data_type']) for col in columns} for _ in range(synthetic_rows)]
+        column_names = [col['column_name'] for col in columns]
+        self._connection.executemany(
+            f"INSERT INTO {name} ({', '.join(self._quote(col) for col in column_names)}) VALUES ({', '.join('?' * len(column_names))})",
+            [[row.get(col) for col in column_names] for row in rows]
+        )
+    
+    def sample_columns(self, db_name, requests, probes, batch_size):
+        samples = {}
+        with self._lock:
+            for table, columns in requests.items():
+                rows = self._connection.execute(
+                    f"SELECT {', '.join(f'CAST({self._quote(col)} AS TEXT)' for col in columns)} "
+                    f"FROM {self._quote(f'{db_name}.{table}')} ORDER BY random() LIMIT {probes * batch_size}"
+                ).fetchall()
+                samples[table] = {col: [row[i] for row in rows] for i, col in enumerate(columns)}
+        return samples
+    
+    def system_value(self, db_name, expression):
+        if expression in self.system_values:
+            return self.system_values[expression]
+        sql = expression if "SELECT" in expression.upper() else f"SELECT {expression}"
+        with self._lock:
+            row = self._connection.execute(sql).fetchone()
+        return row[0] if row else None
+    
+    def describe(self, db_name):
+        return f"SQLite(内存)/{db_name}"
+
+class InMemoryBackend(SampleBackend):
+    """
+    纯内存样本后端，直接从给定的取值池中随机抽取
+    
+    不能执行任何 SQL：未知的表、列或系统信息抛出 KeyError（由填充器用 NULL 兜底）。
+    """
+    
+    def __init__(self, tables: Dict[str, Dict[str, Dict[str, List[Any]]]],
+                 system_values: Dict[str, Any] | None = None):
+        """
+        Args:
+            tables: {数据库: {表: {列: [值, ...]}}}
+            system_values: {系统信息: 值}
+        """
+        self.key = ('memory', id(self))
+        self.tables = tables
+        self.system_values = dict(system_values or {})
+    
+    @classmethod
+    def from_schemas(cls, schemas: List[Dict], system_vars: List[Dict[str, Any]] | None = None,
+                     rows_per_table: int = 50) -> 'InMemoryBackend':
+        """按列类型为每个表生成 rows_per_table 个随机值"""
+        tables = {}
+        for schema in schemas:
+            db_tables = tables.setdefault(schema.get('database_name', 'unknown'), {})
+            for table in schema.get('tables', []):
+                db_tables[table['table_name']] = {
+                    col['column_name']: [synthetic_column_value(col['data_type']) for _ in range(rows_per_table)]
+                    for col in table.get('columns', [])
+                }
+        return cls(tables, synthetic_system_values(system_vars or []))
+    
+    def sample_columns(self, db_name, requests, probes, batch_size):
+        samples = {}
+        for table, columns in requests.items():
+            table_values = self.tables[db_name][table]
+            samples[table] = {}
+            for col in columns:
+                values = table_values[col]
+                samples[table][col] = random.sample(values, min(len(values), probes * batch_size))
+        return samples
+    
+    def system_value(self, db_name, expression):
+        return self.system_values[expression]
+    
+    def describe(self, db_name):
+        return f"内存/{db_name}"
+
+SAMPLE_REFRESH_INTERVAL = 300  # 表样本蓄水池的后台刷新间隔（秒）
+
+class ReservoirSampler:
+    """
+    单个数据库的表样本蓄水池
+    
+    每个 (表, 列) 维护一个固定容量的均匀蓄水池（Algorithm R）。首次用到某些列时，
+    通过样本后端对这些列随机读取 probes 次（同时需要的多个表合并为一次读取）。
+    之后后台线程按间隔继续随机读取并并入蓄水池，每个样本的抽取只是
+    一次内存随机选择，与表的大小无关。
+    """
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    def __init__(self, db_name: str, backend: 'SampleBackend',
+                 reservoir_size: int = 100, batch_size: int = 50, probes: int = 4):
+        """
+        Args:
+            db_name: 数据库名
+            backend: 样本后端
+            reservoir_size: 每列蓄水池容量
+            batch_size: 每次随机读取的行数
+            probes: 首次构建时的随机读取次数
+        """
+        self.db_name = db_name
+        self.backend = backend
+        self.reservoir_size = reservoir_size
+        self.batch_size = batch_size
+        self.probes = probes
+        
+        self._reservoirs = {}  # {(table, column): [非空值, ...]}
+        self._seen = {}        # {(table, column): 已流入的非空值个数}
+        self._lock = threading.Lock()
+        self._refresh_stop = None
+    
+    @classmethod
+    def for_database(cls, db_name: str, backend: 'SampleBackend',
+                     refresh_interval: float | None = None) -> 'ReservoirSampler':
+        """获取（或创建）某个后端上某个数据库共用的蓄水池，refresh_interval 不为空时启动后台刷新"""
+        with cls._instances_lock:
+            sampler = cls._instances.get((backend.key, db_name))
+            if sampler is None:
+                sampler = cls(db_name, backend)
+                cls._instances[(backend.key, db_name)] = sampler
+                if refresh_interval:
+                    sampler.start_background_refresh(refresh_interval)
+            return sampler
+    
+    def _offer(self, key, value: str):
+        """Algorithm R：第 n 个值以 k/n 的概率进入蓄水池"""
+        reservoir = self._reservoirs.setdefault(key, [])
+        seen = self._seen.get(key, 0) + 1
+        self._seen[key] = seen
+        if len(reservoir) < self.reservoir_size:
+            reservoir.append(value)
+        else:
+            j = random.randrange(seen)
+            if j < self.reservoir_size:
+                reservoir[j] = value
+    
+    def _absorb(self, requests: Dict[str, List[str]], samples: Dict[str, Dict[str, List[Any]]]):
+        """将后端读到的值并入各列的蓄水池"""
+        with self._lock:
+            for table, columns in requests.items():
+                for col in columns:
+                    self._reservoirs.setdefault((table, col), [])
+                    for value in samples.get(table, {}).get(col, []):
+                        if value is not None and value != '':
+                            self._offer((table, col), str(value))
+    
+    def _sample_rows(self, requests: Dict[str, List[str]], probes: int):
+        """对所有请求的表各随机读取 probes 次并并入蓄水池"""
+        self._absorb(requests, self.backend.sample_columns(self.db_name, requests, probes, self.batch_size))
+    
+    def ensure(self, requests: Dict[str, List[str]]):
+        """
+        为尚未构建的 (表, 列) 构建蓄水池，所有表合并为一次读取
+        
+        可以传入一个样本或一批样本需要的全部表和列。
+        
+        Raises:
+            DatabaseUnavailableError: 数据库熔断或重试耗尽；SQL 错误抛出原始异常
+        """
+        with self._lock:
+            missing = {}
+            for table, columns in requests.items():
+                missing_columns = [col for col in dict.fromkeys(columns) if (table, col) not in self._reservoirs]
+                if missing_columns:
+                    missing[table] = missing_columns
+        if missing:
+            self._sample_rows(missing, self.probes)
+    
+    def pools(self, table: str, columns: List[str]) -> Dict[str, List[str]]:
+        """返回各列的蓄水池，缺失的列会先构建"""
+        self.ensure({table: columns})
+        with self._lock:
+            return {col: list(self._reservoirs[(table, col)]) for col in columns}
+    
+    def draw_many(self, requests: Dict[str, List[str]], rng=random) -> Dict[str, Dict[str, str]]:
+        """
+        为每个表的每列从蓄水池中随机抽取一个值，蓄水池为空时为 'NULL'
+        
+        Returns:
+            {table: {column: 值}}
+        """
+        self.ensure(requests)
+        with self._lock:
+            samples = {}
+            for table, columns in requests.items():
+                samples[table] = {}
+                for col in columns:
+                    reservoir = self._reservoirs[(table, col)]
+                    samples[table][col] = rng.choice(reservoir) if reservoir else 'NULL'
+            return samples
+    
+    def draw(self, table: str, columns: List[str]) -> Dict[str, str]:
+        """为单个表的每列随机抽取一个值"""
+        return self.draw_many({table: columns})[table]
+    
+    def refresh_once(self):
+        """对所有已构建的表合并随机读取一次，增量更新蓄水池"""
+        with self._lock:
+            columns_by_table = {}
+            for table, col in self._reservoirs:
+                columns_by_table.setdefault(table, []).append(col)
+        if not columns_by_table:
+            return
+        try:
+            self._sample_rows(columns_by_table, 1)
+        except Exception as e:
+            print(f"  ⚠️  警告: 刷新数据库 {self.db_name} 的样本失败 ({e})")
+    
+    def start_background_refresh(self, interval: float):
+        """启动后台线程，每隔 interval 秒增量刷新一次"""
+        if self._refresh_stop is not None:
+            return
+        self._refresh_stop = threading.Event()
+        
+        def _loop(stop_event):
+            while not stop_event.wait(interval):
+                self.refresh_once()
+        
+        threading.Thread(target=_loop, args=(self._refresh_stop,), daemon=True).start()
+    
+    def stop_background_refresh(self):
+        if self._refresh_stop is not None:
+            self._refresh_stop.set()
+            self._refresh_stop = None
+
 class SpecificDatabaseTemplateFiller:
     
+    _shared = {}
+    _shared_lock = threading.Lock()
+    
     TYPE_MAPPING = {
-        'number': ['int', 'integer', 'bigint', 'smallint', 'tinyint', 
-                   'real', 'float', 'double', 'numeric', 'decimal'],
-        'string': ['varchar', 'char', 'text', 'nvarchar', 'nchar', 
-                   'clob', 'blob', 'string'],
-        'date': ['date', 'datetime', 'timestamp', 'time'],
-        'boolean': ['bool', 'boolean', 'bit'],
+        'number': ColumnTypeCategory.NUMBER,
+        'string': ColumnTypeCategory.STRING,
+        'date': ColumnTypeCategory.DATE,
+        'boolean': ColumnTypeCategory.BOOLEAN,
         'all': None  # None 表示不限制
     }
     
-    def __init__(self, db_schema: Dict, mysql_config: Dict[str, Any] = None):
+    # 常量占位符 → (在 expected_types 中对应的类型, 随机取值函数)
+    CONSTANT_PLACEHOLDERS = {
+        '$int$': ('integer', GetRandomAttribute.random_int_number),
+        '$float$': ('float', GetRandomAttribute.random_float_number),
+        '$hex$': ('hex', GetRandomAttribute.random_hex_number),
+        '$time$': ('time', GetRandomAttribute.random_time),
+        '$character$': ('character', GetRandomAttribute.random_character),
+        '$date$': ('date', GetRandomAttribute.random_date)
+    }
+    
+    def __init__(self, db_schema: Dict, mysql_config: Dict[str, Any] = None,
+                 sample_store: SharedSampleStore | None = None, backend: SampleBackend | None = None):
         """
         初始化填充器
         
         Args:
             db_schema: 数据库schema字典
-            mysql_config: MySQL配置字典，包含 host, port, user, password, database, charset
+            mysql_config: MySQL配置字典，包含 host, port, user, password, database, charset（未提供 backend 时必须提供）
+            sample_store: 可选的共享样本库，命中时不再查询后端
+            backend: 样本后端，默认为 mysql_config 对应的 MySQL 后端
         """
         self.db_schema = db_schema
         self.db_name = db_schema.get('database_name', 'unknown')
+        self.sample_store = sample_store
         
-        # MySQL配置
-        if mysql_config is None:
-            raise ValueError("必须提供 mysql_config 参数")
+        if backend is None:
+            if mysql_config is None:
+                raise ValueError("必须提供 mysql_config 或 backend 参数")
+            backend = PyMySQLBackend.for_config(mysql_config)
         self.mysql_config = mysql_config
+        self.backend = backend
+        self.sampler = ReservoirSampler.for_database(self.db_name, backend, SAMPLE_REFRESH_INTERVAL)
         
         # 构建表信息
         self.tables_info = {}
@@ -171,62 +1186,65 @@ class SpecificDatabaseTemplateFiller:
                 'columns': columns,
                 'types': column_types
             }
+        
+        # 预先按每种类型约束筛选好各表的列：{table: {expected_type: [column, ...]}}
+        self.columns_by_type = {
+            table_name: {
+                expected_type: self._filter_columns_by_type(info['columns'], info['types'], expected_type)
+                for expected_type in [*self.TYPE_MAPPING, 'table']
+            }
+            for table_name, info in self.tables_info.items()
+        }
     
-    def _get_mysql_connection(self):
-        """创建MySQL连接"""
-        try:
-            connection = pymysql.connect(
-                host=self.mysql_config['host'],
-                port=self.mysql_config['port'],
-                user=self.mysql_config['user'],
-                password=self.mysql_config['password'],
-                database=self.mysql_config['database'],
-                charset=self.mysql_config.get('charset', 'utf8mb4'),
-                cursorclass=pymysql.cursors.DictCursor
-            )
-            return connection
-        except Exception as e:
-            print(f"MySQL 连接失败: {e}")
-            return None
+    @classmethod
+    def for_schema(cls, db_schema: Dict, mysql_config: Dict[str, Any] = None,
+                   sample_store: SharedSampleStore | None = None, backend: SampleBackend | None = None) -> 'SpecificDatabaseTemplateFiller':
+        """
+        获取（或创建）某个数据库共用的填充器
+        
+        填充器不保存单个样本的状态（见 FillPlan），可以在线程间共享，只需建立一次索引。
+        各列的样本在模板第一次用到时才读取（见 ReservoirSampler.ensure）。
+        """
+        if backend is None:
+            if mysql_config is None:
+                raise ValueError("必须提供 mysql_config 或 backend 参数")
+            backend = PyMySQLBackend.for_config(mysql_config)
+        key = (backend.key, db_schema.get('database_name', 'unknown'), id(sample_store))
+        with cls._shared_lock:
+            filler = cls._shared.get(key)
+            if filler is None:
+                filler = cls(db_schema, mysql_config, sample_store, backend)
+                cls._shared[key] = filler
+            return filler
     
     def fill_template(self, template_input, debug=False) -> str:
+        plan = self.prepare(template_input, debug)
+        self.fetch_samples(plan, debug)
+        return self.render(plan, debug)
+    
+    def prepare(self, template_input, debug=False, verbose=True, rng=random) -> FillPlan:
+        """
+        解析模板、分配表和列，并整理需要读取的样本（不访问数据库）
+        
+        verbose 为 False 时不打印警告；所有随机选择使用 rng（之后的读取和替换同样使用，见 FillPlan.rng）
+        """
         if isinstance(template_input, str):
             template = template_input
             expected_types = []
+            information_features = None
             if debug:
                 print("📝 输入类型: 字符串（无类型约束）")
         elif isinstance(template_input, dict):
             template = template_input.get('payload', '')
             expected_types = template_input.get('expected_types', [])
+            information_features = template_input.get('information_features')
             if debug:
                 print(f"📝 输入类型: 字典")
                 print(f"📝 expected_types: {expected_types}")
         else:
             raise ValueError("template_input 必须是字符串或字典")
         
-        if "$int$" in template:
-            template = template.replace("$int$", GetRandomAttribute.random_int_number())
-            expected_types = [item for item in expected_types if item != "integer"]
-        
-        if "$float$" in template:
-            template = template.replace("$float$", GetRandomAttribute.random_float_number())
-            expected_types = [item for item in expected_types if item != "float"]
-        
-        if "$hex$" in template:
-            template = template.replace("$hex$", GetRandomAttribute.random_hex_number())
-            expected_types = [item for item in expected_types if item != "hex"]
-        
-        if "$time$" in template:
-            template = template.replace("$time$", GetRandomAttribute.random_time())
-            expected_types = [item for item in expected_types if item != "time"]
-            
-        if "$character$" in template:
-            template = template.replace("$character$", GetRandomAttribute.random_character())
-            expected_types = [item for item in expected_types if item != "character"]
-            
-        if "$date$" in template:
-            template = template.replace("$date$", GetRandomAttribute.random_date())
-            expected_types = [item for item in expected_types if item != "date"]
+        template, expected_types = self._replace_constant_placeholders(template, expected_types, rng)
         
         # Step 1: 解析模板，提取所有占位符
         placeholders = self._parse_marked_template(template)
@@ -234,125 +1252,174 @@ class SpecificDatabaseTemplateFiller:
         if debug:
             print(f"📝 占位符数量: {len(placeholders)}")
             for i, p in enumerate(placeholders):
-                print(f"  {i}: {p['full_match']} (type={p['type']})")
+                print(f"  {i}: {p.full_match} (type={p.type})")
         
-        # Step 2: 验证并调整 expected_types 长度
-        if expected_types:
-            if len(expected_types) != len(placeholders):
+        # Step 2: 验证并调整 expected_types 长度，为占位符分配类型约束
+        if not self._bind_expected_types(placeholders, expected_types, debug):
+            run_stats.increment('expected_types_mismatches')
+            if verbose or debug:
                 print(f"⚠️  警告: expected_types 长度 ({len(expected_types)}) "
                       f"与占位符数量 ({len(placeholders)}) 不匹配")
-                print([placeholder['type'] for placeholder in placeholders])
+                print([placeholder.type for placeholder in placeholders])
                 print(expected_types)
                 print(template)
                 print("\n")
-                # 如果长度不匹配，用 'all' 填充或截断
-                if len(expected_types) < len(placeholders):
-                    expected_types.extend(['all'] * (len(placeholders) - len(expected_types)))
-                else:
-                    expected_types = expected_types[:len(placeholders)]
-            
-            # 为占位符分配类型约束
-            for i, placeholder in enumerate(placeholders):
-                placeholder['expected_type'] = expected_types[i]
-                if debug:
-                    print(f"  {placeholder['full_match']} → expected_type: {expected_types[i]}")
-        else:
-            # 如果没有提供 expected_types，默认为 'all'
-            for placeholder in placeholders:
-                placeholder['expected_type'] = 'all'
-            if debug:
-                print("⚠️  未提供 expected_types，所有占位符使用 'all'")
         
         # Step 3: 统计需要多少个表
         max_table_id = self._get_max_table_id(placeholders)
         
-        # Step 4: 分配表并获取数据（带类型约束）
-        table_assignments = self._assign_tables_with_types(max_table_id, placeholders, debug)
+        # Step 4: 分配表（带类型约束）
+        table_assignments = self._assign_tables_with_types(max_table_id, placeholders, debug, rng)
         
-        # Step 5: 为每个占位符生成替换值
+        # Step 5: 确定所有 sample 占位符对应的列
+        sample_requests = self._collect_sample_requests(placeholders, table_assignments, rng)
+        if debug and sample_requests:
+            print(f"📥 需要读取样本: {sample_requests}")
+        
+        return FillPlan(
+            template=template,
+            information_features=information_features,
+            placeholders=placeholders,
+            table_assignments=table_assignments,
+            sample_requests=sample_requests,
+            verbose=verbose,
+            rng=rng
+        )
+    
+    def fetch_samples(self, plan: FillPlan, debug=False):
+        """一次性读取 plan 中所有 sample 占位符需要的样本"""
+        if not plan.sample_requests:
+            return
+        samples = self._get_samples_for_tables(plan.sample_requests, plan)
+        for table_data in plan.table_assignments.values():
+            table_data.samples.update(samples.get(table_data.table, {}))
+        if debug:
+            print(f"📥 样本: {samples}")
+    
+    def render(self, plan: FillPlan, debug=False) -> str:
+        """用已分配的表、列和样本替换所有占位符"""
+        # Step 6: 为每个占位符生成替换值
         replacement_values = []
         
-        for i, placeholder in enumerate(placeholders):
-            value = self._get_marked_replacement(placeholder, table_assignments, template_input['information_features'], debug)
+        for placeholder in plan.placeholders:
+            value = self._get_marked_replacement(placeholder, plan.table_assignments, plan.information_features, debug, plan.rng)
             replacement_values.append(value)
             if debug:
-                print(f"  {placeholder['full_match']} → {value}")
+                print(f"  {placeholder.full_match} → {value}")
         
-        # Step 6: 从后向前替换（避免位置偏移）
-        result = template
-        for placeholder, value in reversed(list(zip(placeholders, replacement_values))):
+        # Step 7: 从后向前替换（避免位置偏移）
+        result = plan.template
+        for placeholder, value in reversed(list(zip(plan.placeholders, replacement_values))):
             result = (
-                result[:placeholder['start']] + 
+                result[:placeholder.start] + 
                 value + 
-                result[placeholder['end']:]
+                result[placeholder.end:]
             )
         
         return result
     
-    def _parse_marked_template(self, template: str) -> List[Dict]:
+    def _replace_constant_placeholders(self, template: str, expected_types: List[str], rng=random):
         """
-        解析带标记的模板
+        替换常量占位符（同一种占位符使用同一个随机值），并从 expected_types 中去掉对应类型
         
-        支持的格式:
-        - $table_N$
-        - $column_tN_M$
-        - $sample_tN_M$
+        Returns:
+            (替换后的模板, 剩余的 expected_types)
         """
-        placeholders = []
+        for marker, (type_name, generate) in self.CONSTANT_PLACEHOLDERS.items():
+            if marker in template:
+                template = template.replace(marker, generate(rng=rng))
+                expected_types = [item for item in expected_types if item != type_name]
+        return template, expected_types
+    
+    def _bind_expected_types(self, placeholders: List[Placeholder], expected_types: List[str], debug=False) -> bool:
+        """
+        为占位符分配类型约束
         
-        # 匹配所有占位符
+        长度不匹配时用 'all' 填充或截断；没有提供 expected_types 时全部为 'all'
+        
+        Returns:
+            expected_types 长度是否与占位符数量一致
+        """
+        if not expected_types:
+            # 如果没有提供 expected_types，默认为 'all'
+            for placeholder in placeholders:
+                placeholder.expected_type = 'all'
+            if debug:
+                print("⚠️  未提供 expected_types，所有占位符使用 'all'")
+            return True
+        
+        matched = len(expected_types) == len(placeholders)
+        # 如果长度不匹配，用 'all' 填充或截断（不修改传入的列表）
+        expected_types = list(expected_types[:len(placeholders)])
+        expected_types.extend(['all'] * (len(placeholders) - len(expected_types)))
+        
+        for placeholder, expected_type in zip(placeholders, expected_types):
+            placeholder.expected_type = expected_type
+            if debug:
+                print(f"  {placeholder.full_match} → expected_type: {expected_type}")
+        
+        return matched
+    
+    def _parse_marked_template(self, template: str) -> List[Placeholder]:
+        """
+        解析带标记的模板
+        
+        支持的格式:
+        - $table_N$
+        - $column_tN_M$
+        - $sample_tN_M$
+        """
+        placeholders = []
+        
+        # 匹配所有占位符
         pattern = r'\$(\w+)\$'
         
         for match in re.finditer(pattern, template):
             full_match = match.group(0)
             content = match.group(1)
             
-            placeholder = {
-                'full_match': full_match,
-                'start': match.start(),
-                'end': match.end()
-            }
+            placeholder = Placeholder(full_match, match.start(), match.end())
             
             # 解析 $table_N$
             table_match = re.match(r'table_(\d+)', content)
             if table_match:
-                placeholder['type'] = 'table'
-                placeholder['table_id'] = table_match.group(1)
+                placeholder.type = 'table'
+                placeholder.table_id = table_match.group(1)
                 placeholders.append(placeholder)
                 continue
             
             # 解析 $column_tN_M$
             column_match = re.match(r'column_t(\d+)_(\d+)', content)
             if column_match:
-                placeholder['type'] = 'column'
-                placeholder['table_id'] = column_match.group(1)
-                placeholder['column_id'] = column_match.group(2)
+                placeholder.type = 'column'
+                placeholder.table_id = column_match.group(1)
+                placeholder.column_id = column_match.group(2)
                 placeholders.append(placeholder)
                 continue
             
             # 解析 $sample_tN_M$
             sample_match = re.match(r'sample_t(\d+)_(\d+)', content)
             if sample_match:
-                placeholder['type'] = 'sample'
-                placeholder['table_id'] = sample_match.group(1)
-                placeholder['column_id'] = sample_match.group(2)
+                placeholder.type = 'sample'
+                placeholder.table_id = sample_match.group(1)
+                placeholder.column_id = sample_match.group(2)
                 placeholders.append(placeholder)
                 continue
             
             # 如果都不匹配，标记为未知类型
-            placeholder['type'] = 'unknown'
-            placeholder['content'] = content
+            placeholder.type = 'unknown'
+            placeholder.content = content
             placeholders.append(placeholder)
         
         return placeholders
     
-    def _get_max_table_id(self, placeholders: List[Dict]) -> int:
+    def _get_max_table_id(self, placeholders: List[Placeholder]) -> int:
         """获取最大的表ID"""
         max_id = 0
         
         for p in placeholders:
-            if 'table_id' in p:
-                table_id = int(p['table_id'])
+            if p.table_id is not None:
+                table_id = int(p.table_id)
                 max_id = max(max_id, table_id)
         
         return max_id
@@ -372,33 +1439,32 @@ class SpecificDatabaseTemplateFiller:
         if not type_constraints:
             return True
         
-        table_info = self.tables_info[table_name]
-        all_columns = table_info['columns']
-        all_types = table_info['types']
+        columns_by_type = self.columns_by_type[table_name]
         
         for column_id, expected_type in type_constraints.items():
             # 检查是否有符合类型的列
-            filtered = self._filter_columns_by_type(all_columns, all_types, expected_type)
-            if not filtered:
+            if not columns_by_type.get(expected_type):
                 return False
         
         return True
     
-    def _assign_tables_with_types(self, table_count: int, placeholders: List[Dict], debug=False) -> Dict[str, Dict]:
+    def _collect_type_constraints(self, placeholders: List[Placeholder], debug=False) -> Dict[str, Dict[str, str]]:
         """
-        为每个表ID分配实际的表（带类型约束）
+        收集每个表ID需要的类型约束
+        
+        Returns:
+            {table_id: {column_id: expected_type}}
         """
-        # 收集每个表ID需要的类型约束
         table_type_constraints = {}  # {table_id: {column_id: expected_type}}
         
         for placeholder in placeholders:
-            ptype = placeholder['type']
+            ptype = placeholder.type
             
             # 只处理 column 和 sample（它们需要类型约束）
             if ptype in ['column', 'sample']:
-                table_id = placeholder['table_id']
-                column_id = placeholder['column_id']
-                expected_type = placeholder.get('expected_type', 'all')
+                table_id = placeholder.table_id
+                column_id = placeholder.column_id
+                expected_type = placeholder.expected_type
                 
                 if table_id not in table_type_constraints:
                     table_type_constraints[table_id] = {}
@@ -418,6 +1484,29 @@ class SpecificDatabaseTemplateFiller:
         if debug:
             print(f"📊 类型约束汇总: {table_type_constraints}")
         
+        return table_type_constraints
+    
+    def find_unsatisfiable_tables(self, placeholders: List[Placeholder]) -> List[str]:
+        """
+        检查每个表ID是否存在能满足其类型约束的表
+        
+        Returns:
+            无法满足的表ID的说明，全部可满足时为空列表
+        """
+        table_type_constraints = self._collect_type_constraints(placeholders)
+        problems = []
+        for i in range(1, self._get_max_table_id(placeholders) + 1):
+            type_constraints = table_type_constraints.get(str(i), {})
+            if not any(self._can_table_satisfy_constraints(table, type_constraints) for table in self.table_names):
+                problems.append(f"$table_{i}$ 在 {self.db_name} 中找不到满足 {type_constraints} 的表")
+        return problems
+    
+    def _assign_tables_with_types(self, table_count: int, placeholders: List[Placeholder], debug=False, rng=random) -> Dict[str, TableAssignment]:
+        """
+        为每个表ID分配实际的表（带类型约束）
+        """
+        table_type_constraints = self._collect_type_constraints(placeholders, debug)
+        
         # 为每个表ID分配表
         assignments = {}
         used_tables = set()
@@ -434,7 +1523,7 @@ class SpecificDatabaseTemplateFiller:
             
             # 先尝试找到满足约束的表
             for attempt in range(max_attempts):
-                candidate = random.choice(self.table_names)
+                candidate = rng.choice(self.table_names)
                 
                 # 检查是否已使用（如果表足够多）
                 if len(self.table_names) >= table_count and candidate in used_tables:
@@ -450,7 +1539,7 @@ class SpecificDatabaseTemplateFiller:
             if selected_table is None:
                 if debug:
                     print(f"⚠️  警告: 找不到满足约束的表（table_id={table_id}），随机选择")
-                selected_table = random.choice(self.table_names)
+                selected_table = rng.choice(self.table_names)
             
             # 获取表信息
             table_info = self.tables_info[selected_table]
@@ -464,26 +1553,21 @@ class SpecificDatabaseTemplateFiller:
             # 为每个 column_id 筛选符合类型的列
             filtered_columns_by_id = {}
             for column_id, expected_type in type_constraints.items():
-                filtered = self._filter_columns_by_type(
-                    all_columns, all_types, expected_type
-                )
+                filtered = self.columns_by_type[selected_table].get(expected_type, [])
                 filtered_columns_by_id[column_id] = filtered
                 
                 if debug:
                     print(f"   column_id {column_id} (type={expected_type}): {filtered}")
             
-            # 获取样本数据（从MySQL）
-            samples = self._get_table_samples(selected_table, all_columns)
-            
-            assignments[table_id] = {
-                'table': selected_table,
-                'columns': all_columns,
-                'types': all_types,
-                'samples': samples,
-                'column_map': {},
-                'type_constraints': type_constraints,
-                'filtered_columns': filtered_columns_by_id
-            }
+            # 样本数据按需获取（只取 sample 占位符实际用到的列）
+            assignments[table_id] = TableAssignment(
+                table=selected_table,
+                columns=all_columns,
+                types=all_types,
+                samples={},
+                type_constraints=type_constraints,
+                filtered_columns=filtered_columns_by_id
+            )
         
         return assignments
     
@@ -496,85 +1580,140 @@ class SpecificDatabaseTemplateFiller:
         if expected_type == 'all' or expected_type == 'table':
             return columns  # 不限制类型
         
-        # 获取允许的数据库类型
-        allowed_db_types = self.TYPE_MAPPING.get(expected_type, [])
-        if allowed_db_types is None:  # 'all' 的情况
+        # 获取允许的类型类别
+        if expected_type not in self.TYPE_MAPPING:
+            return []
+        allowed_category = self.TYPE_MAPPING[expected_type]
+        if allowed_category is None:  # 'all' 的情况
             return columns
         
         # 过滤列
-        filtered = []
-        for col in columns:
-            col_type = types.get(col, '').lower()
-            
-            # 检查列类型是否匹配
-            type_matched = False
-            for allowed_type in allowed_db_types:
-                if col_type == allowed_type or col_type.startswith(allowed_type):
-                    type_matched = True
-                    break
-            
-            if type_matched:
-                filtered.append(col)
+        filtered = [col for col in columns if classify_column_type(types.get(col, '')) is allowed_category]
         
         return filtered  # 🔥 不再兜底，返回空列表由上层处理
     
+    def _get_samples_for_tables(self, requests: Dict[str, List[str]], plan: FillPlan | None = None) -> Dict[str, Dict[str, str]]:
+        """
+        为多个表的列各随机抽取一个样本值
+        
+        共享样本库中没有的表合并交给蓄水池，一次往返读取；合并读取失败时逐表重试，
+        只有读取失败的表用 NULL 兜底
+        
+        Args:
+            requests: {table: [column, ...]}
+            plan: 用于记录兜底次数的填充计划
+        
+        Returns:
+            {table: {column: 值}}，读取失败的列为 'NULL'
+        """
+        rng = plan.rng if plan is not None else random
+        samples = {}
+        remaining = {}
+        for table, columns in requests.items():
+            # 优先从共享样本库中抽取
+            if self.sample_store is not None:
+                keys = [SharedSampleStore.column_key(self.db_name, table, col) for col in columns]
+                if all(key in self.sample_store for key in keys):
+                    samples[table] = {}
+                    for col, key in zip(columns, keys):
+                        value = self.sample_store.choice(key, rng)
+                        samples[table][col] = value if value is not None else 'NULL'
+                    continue
+            remaining[table] = columns
+        
+        if remaining:
+            try:
+                samples.update(self.sampler.draw_many(remaining, rng))
+            except DatabaseUnavailableError:
+                raise
+            except Exception as e:
+                failed = {}
+                if len(remaining) == 1:
+                    failed = {table: e for table in remaining}
+                else:
+                    for table, columns in remaining.items():
+                        try:
+                            samples.update(self.sampler.draw_many({table: columns}, rng))
+                        except DatabaseUnavailableError:
+                            raise
+                        except Exception as table_error:
+                            failed[table] = table_error
+                for table, error in failed.items():
+                    if plan is None or plan.verbose:
+                        print(f"  ⚠️  警告: 读取表 {table} 失败 ({error})")
+                    columns = remaining[table]
+                    samples[table] = {col: 'NULL' for col in columns}
+                    if plan is not None:
+                        plan.fallback_count += len(columns)
+                    run_stats.increment('sample_fallbacks', len(columns))
+        
+        return samples
+    
     def _get_table_samples(self, table: str, columns: List[str]) -> Dict[str, str]:
-        """从MySQL数据库中获取表的样本数据（随机选择）"""
-        connection = None
-        try:
-            connection = self._get_mysql_connection()
-            if connection is None:
-                return {col: 'NULL' for col in columns}
-            
-            with connection.cursor() as cursor:
-                # 处理列名（可能包含特殊字符）
-                quoted_columns = [f'`{col}`' for col in columns]
-                columns_str = ', '.join(quoted_columns)
-                
-                # 读取前100行
-                
-                sql = f"SELECT {columns_str} FROM {self.db_name}.`{table}` LIMIT 100"
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-                
-                if not rows:
-                    return {col: 'NULL' for col in columns}
-                
-                # 为每一列收集所有非空值，然后随机选择
-                samples = {}
-                for col in columns:
-                    # 收集该列的所有非空值
-                    non_null_values = []
-                    for row in rows:
-                        value = row.get(col)
-                        if value is not None and value != '':
-                            non_null_values.append(str(value))
-                    
-                    # 如果有非空值，随机选择一个；否则使用 'NULL'
-                    if non_null_values:
-                        samples[col] = random.choice(non_null_values)
-                    else:
-                        samples[col] = 'NULL'
-                
-                return samples
-                
-        except Exception as e:
-            print(f"  ⚠️  警告: 读取表 {table} 失败 ({e})")
-            return {col: 'NULL' for col in columns}
-        finally:
-            if connection:
-                connection.close()
- 
-    def _get_marked_replacement(self, placeholder: Dict, 
-                               table_assignments: Dict, information_features: str, debug=False) -> str:
+        """从表的样本蓄水池中为每列随机抽取一个值"""
+        return self._get_samples_for_tables({table: columns})[table]
+    
+    def _collect_sample_requests(self, placeholders: List[Placeholder], 
+                                 table_assignments: Dict[str, TableAssignment], rng=random) -> Dict[str, List[str]]:
+        """
+        为所有 sample 占位符确定列，汇总需要读取样本的表和列
+        
+        Returns:
+            {table: [column, ...]}
+        """
+        requests = {}
+        for placeholder in placeholders:
+            if placeholder.type != 'sample' or placeholder.table_id not in table_assignments:
+                continue
+            table_data = table_assignments[placeholder.table_id]
+            column_name = self._resolve_column_name(table_data, placeholder.column_id, rng=rng)
+            if column_name not in table_data.samples:
+                requests.setdefault(table_data.table, [])
+                if column_name not in requests[table_data.table]:
+                    requests[table_data.table].append(column_name)
+        return requests
+    
+    def _resolve_column_name(self, table_data: TableAssignment, column_id: str, debug=False, rng=random) -> str:
+        """为列ID确定列名（同一个列ID在模板中只选一次）"""
+        # 检查是否已经为这个列ID分配了列名
+        if column_id in table_data.column_map:
+            return table_data.column_map[column_id]
+        
+        # 使用类型过滤后的列
+        if column_id in table_data.filtered_columns:
+            available_columns = table_data.filtered_columns[column_id]
+            if debug:
+                print(f"    🔍 使用过滤后的列: {available_columns}")
+        else:
+            # 如果没有类型约束，使用所有列
+            available_columns = table_data.columns
+            if debug:
+                print(f"    🔍 使用所有列: {available_columns}")
+        
+        if not available_columns:
+            # 🔥 如果过滤后没有列，使用所有列（兜底）
+            available_columns = table_data.columns
+            if debug:
+                print(f"    ⚠️  过滤后无列，使用所有列: {available_columns}")
+        
+        column_name = rng.choice(available_columns)
+        table_data.column_map[column_id] = column_name
+        
+        if debug:
+            print(f"    ✅ 选中列: {column_name} (type={table_data.types.get(column_name)})")
+        
+        return column_name
+    
+    def _get_marked_replacement(self, placeholder: Placeholder, 
+                               table_assignments: Dict[str, TableAssignment], information_features: str, debug=False, rng=random) -> str:
         """根据标记获取替换值（支持类型约束）"""
-        ptype = placeholder['type']
+        ptype = placeholder.type
         
         # 处理 $table_N$
         if ptype == 'table':
-            table_id = placeholder['table_id']
+            table_id = placeholder.table_id
             if table_id in table_assignments:
-                table_name = table_assignments[table_id]['table']
+                table_name = table_assignments[table_id].table
                 # 根据 information_features 决定是否添加数据库名前缀
                 if information_features == "specific database":
                     return table_name
@@ -584,40 +1723,15 @@ class SpecificDatabaseTemplateFiller:
         
         # 处理 $column_tN_M$
         if ptype == 'column':
-            table_id = placeholder['table_id']
-            column_id = placeholder['column_id']
+            table_id = placeholder.table_id
+            column_id = placeholder.column_id
             
             if table_id not in table_assignments:
                 return 'unknown_column'
             
             table_data = table_assignments[table_id]
             
-            # 检查是否已经为这个列ID分配了列名
-            if column_id in table_data['column_map']:
-                column_name = table_data['column_map'][column_id]
-            else:
-                # 使用类型过滤后的列
-                if column_id in table_data['filtered_columns']:
-                    available_columns = table_data['filtered_columns'][column_id]
-                    if debug:
-                        print(f"    🔍 使用过滤后的列: {available_columns}")
-                else:
-                    # 如果没有类型约束，使用所有列
-                    available_columns = table_data['columns']
-                    if debug:
-                        print(f"    🔍 使用所有列: {available_columns}")
-                
-                if not available_columns:
-                    # 🔥 如果过滤后没有列，使用所有列（兜底）
-                    available_columns = table_data['columns']
-                    if debug:
-                        print(f"    ⚠️  过滤后无列，使用所有列: {available_columns}")
-                
-                column_name = random.choice(available_columns)
-                table_data['column_map'][column_id] = column_name
-                
-                if debug:
-                    print(f"    ✅ 选中列: {column_name} (type={table_data['types'].get(column_name)})")
+            column_name = self._resolve_column_name(table_data, column_id, debug, rng)
             
             # 处理包含特殊字符的列名
             if ' ' in column_name or '-' in column_name or '(' in column_name:
@@ -627,8 +1741,8 @@ class SpecificDatabaseTemplateFiller:
         
         # 处理 $sample_tN_M$
         if ptype == 'sample':
-            table_id = placeholder['table_id']
-            column_id = placeholder['column_id']
+            table_id = placeholder.table_id
+            column_id = placeholder.column_id
             
             if table_id not in table_assignments:
                 return 'NULL'
@@ -636,56 +1750,43 @@ class SpecificDatabaseTemplateFiller:
             table_data = table_assignments[table_id]
             
             # 获取对应的列名（必须先有列名）
-            if column_id not in table_data['column_map']:
-                # 使用类型过滤后的列
-                if column_id in table_data['filtered_columns']:
-                    available_columns = table_data['filtered_columns'][column_id]
-                else:
-                    available_columns = table_data['columns']
-                
-                if not available_columns:
-                    available_columns = table_data['columns']
-                
-                column_name = random.choice(available_columns)
-                table_data['column_map'][column_id] = column_name
-            else:
-                column_name = table_data['column_map'][column_id]
+            column_name = self._resolve_column_name(table_data, column_id, rng=rng)
             
-            # 获取该列的样本值
-            sample_value = table_data['samples'].get(column_name, 'NULL')
+            # 获取该列的样本值（通常已由 fetch_samples 读取）
+            if column_name not in table_data.samples:
+                table_data.samples.update(self._get_table_samples(table_data.table, [column_name]))
+            sample_value = table_data.samples.get(column_name, 'NULL')
             
             if sample_value == 'NULL':
                 return 'NULL'
             
             # 格式化样本值
-            col_type = table_data['types'].get(column_name, 'varchar')
+            col_type = table_data.types.get(column_name, 'varchar')
             return self._format_sample(sample_value, col_type)
         
         # 未知类型
-        return placeholder.get('content', 'unknown')
+        return placeholder.content or 'unknown'
     
     def _format_sample(self, sample: Any, data_type: str = 'varchar') -> str:
         """格式化样本数据"""
         if sample is None or sample == 'NULL':
             return 'NULL'
         
-        data_type = data_type.lower()
+        category = classify_column_type(data_type)
         
         # 数值类型：不加引号
-        if data_type in ['int', 'integer', 'double', 'float', 'real', 'numeric', 'decimal', 
-                         'bigint', 'smallint', 'tinyint']:
+        if category is ColumnTypeCategory.NUMBER:
             return str(sample)
         
         # 日期类型：加引号
-        if data_type in ['date', 'datetime', 'timestamp', 'time']:
+        if category is ColumnTypeCategory.DATE:
             return f"'{sample}'"
         
         # 字符串类型：加引号，转义单引号
         if isinstance(sample, str):
             # 如果是纯数字字符串，根据类型决定是否加引号
             if sample.replace('.', '').replace('-', '').isdigit():
-                if data_type in ['varchar', 'char', 'text', 'nvarchar', 'nchar', 
-                                 'clob', 'blob', 'string']:
+                if category is ColumnTypeCategory.STRING:
                     escaped = sample.replace("'", "''")
                     return f"'{escaped}'"
                 else:
@@ -697,29 +1798,42 @@ class SpecificDatabaseTemplateFiller:
         return str(sample)
     
     def test_connection(self) -> bool:
-        connection = self._get_mysql_connection()
-        if connection:
-            connection.close()
-            print(f"✓ MySQL 连接成功: {self.mysql_config['host']}:{self.mysql_config['port']}/{self.mysql_config['database']}")
+        try:
+            self.backend.ping(self.db_name)
+            print(f"✓ 连接成功: {self.backend.describe(self.db_name)}")
             return True
-        else:
-            print(f"✗ MySQL 连接失败")
+        except Exception as e:
+            print(f"✗ 连接失败: {e}")
             return False
 
 class SystemInformationTemplateFiller:
     
+    _shared = {}
+    _shared_lock = threading.Lock()
+    
     def __init__(self, 
                  system_information_list: List[Dict[str, Any]], 
-                 mysql_config: Dict[str, Any]):
+                 mysql_config: Dict[str, Any] = None,
+                 sample_store: SharedSampleStore | None = None,
+                 backend: SampleBackend | None = None):
         """
         初始化填充器
         
         Args:
             system_information_list: 系统信息列表，每个元素包含variable, type, description
-            mysql_config: MySQL配置字典，包含 host, port, user, password, database
+            mysql_config: MySQL配置字典，包含 host, port, user, password, database（未提供 backend 时必须提供）
+            sample_store: 可选的共享样本库，命中时不再查询后端
+            backend: 样本后端，默认为 mysql_config 对应的 MySQL 后端
         """
         self.system_information_list = system_information_list
         self.mysql_config = mysql_config
+        self.sample_store = sample_store
+        if backend is None:
+            if mysql_config is None:
+                raise ValueError("必须提供 mysql_config 或 backend 参数")
+            backend = PyMySQLBackend.for_config(mysql_config)
+        self.backend = backend
+        self.db_name = mysql_config.get('database') if mysql_config else None
         
         # 按类型分类系统信息，便于快速查找
         self.sysinfo_by_type = {
@@ -729,6 +1843,23 @@ class SystemInformationTemplateFiller:
         }
         self._categorize_system_information()
     
+    @classmethod
+    def for_database(cls, system_information_list: List[Dict[str, Any]], mysql_config: Dict[str, Any] = None,
+                     sample_store: SharedSampleStore | None = None,
+                     backend: SampleBackend | None = None) -> 'SystemInformationTemplateFiller':
+        """获取（或创建）某个数据库共用的填充器（不保存单个样本的状态，可以在线程间共享）"""
+        if backend is None:
+            if mysql_config is None:
+                raise ValueError("必须提供 mysql_config 或 backend 参数")
+            backend = PyMySQLBackend.for_config(mysql_config)
+        key = (backend.key, (mysql_config or {}).get('database'), id(sample_store), id(system_information_list))
+        with cls._shared_lock:
+            filler = cls._shared.get(key)
+            if filler is None:
+                filler = cls(system_information_list, mysql_config, sample_store, backend)
+                cls._shared[key] = filler
+            return filler
+    
     def _categorize_system_information(self):
         """将系统信息按类型分类"""
         for info in self.system_information_list:
@@ -740,73 +1871,37 @@ class SystemInformationTemplateFiller:
             # all类型包含所有信息
             self.sysinfo_by_type['all'].append(info)
     
-    def _query_mysql(self, sql: str) -> str:
+    def _select_sample_for_system_information(self, system_information: str, plan: FillPlan | None = None) -> str:
         """
-        执行 MySQL 查询
+        从数据库中获取系统信息的样本值
         
         Args:
-            sql: SQL查询语句
+            system_information: 系统信息变量或SQL语句
+            plan: 用于记录兜底次数的填充计划
             
         Returns:
             查询结果的字符串表示
         """
-        connection = None
+        if self.sample_store is not None:
+            key = SharedSampleStore.sysinfo_key(self.db_name, system_information)
+            if key in self.sample_store:
+                return self.sample_store.choice(key, plan.rng if plan is not None else random) or ''
+        
         try:
-            # 建立连接
-            connection = pymysql.connect(
-                host=self.mysql_config['host'],
-                port=self.mysql_config['port'],
-                user=self.mysql_config['user'],
-                password=self.mysql_config['password'],
-                database=self.mysql_config['database'],
-                charset=self.mysql_config.get('charset', 'utf8mb4'),
-                cursorclass=pymysql.cursors.DictCursor
-            )
-            
-            with connection.cursor() as cursor:
-                cursor.execute(sql)
-                result = cursor.fetchone()
-                
-                # 处理查询结果
-                if result is None:
-                    return ''
-                
-                # 如果是字典类型（DictCursor），获取第一个值
-                if isinstance(result, dict):
-                    first_value = next(iter(result.values())) if result else None
-                    return str(first_value) if first_value is not None else ''
-                # 如果是元组类型
-                elif isinstance(result, tuple):
-                    return str(result[0]) if result[0] is not None else ''
-                else:
-                    return str(result)
-                
+            value = self.backend.system_value(self.db_name, system_information)
+        except DatabaseUnavailableError:
+            raise
         except Exception as e:
-            print(f"MySQL 查询失败 [{sql}]: {e}")
+            if plan is None or plan.verbose:
+                print(f"查询系统信息失败 [{system_information}]: {e}")
+            if plan is not None:
+                plan.fallback_count += 1
+            run_stats.increment('sysinfo_fallbacks')
             return ''
-        finally:
-            if connection:
-                connection.close()
-    
-    def _select_sample_for_system_information(self, system_information: str) -> str:
-        """
-        从数据库中获取系统信息的样本值
-        
-        Args:
-            system_information: 系统信息变量或SQL语句
-            
-        Returns:
-            查询结果的字符串表示
-        """
-        # 如果不包含SELECT，添加SELECT前缀
-        if "SELECT" not in system_information.upper():
-            sql = f"SELECT {system_information}"
-        else:
-            sql = system_information
         
-        return self._query_mysql(sql)
+        return str(value) if value is not None else ''
     
-    def _get_random_system_information(self, expected_type: str) -> str:
+    def _get_random_system_information(self, expected_type: str, rng=random) -> str:
         """
         根据期望类型随机选择一个系统信息变量
         
@@ -827,10 +1922,20 @@ class SystemInformationTemplateFiller:
             return "VERSION()" if expected_type == 'string' else "1"
         
         # 随机选择一个
-        selected = random.choice(candidates)
+        selected = rng.choice(candidates)
         return selected['variable']
     
     def fill_template(self, template: Dict[str, Any]) -> str:
+        plan = self.prepare(template)
+        self.fetch_samples(plan)
+        return self.render(plan)
+    
+    def prepare(self, template: Dict[str, Any], debug=False, verbose=True, rng=random) -> FillPlan:
+        """
+        选择并替换 $sysInfo$，记录 $sample$ 需要查询的系统信息（不访问数据库）
+        
+        verbose 为 False 时不打印警告；随机选择使用 rng（替换常量时同样使用，见 FillPlan.rng）
+        """
         payload = template['payload']
         expected_types = template.get('expected_types', [])
         
@@ -847,16 +1952,30 @@ class SystemInformationTemplateFiller:
                 expected_type = 'all'
             
             # 随机选择系统信息
-            sysinfo = self._get_random_system_information(expected_type)
+            sysinfo = self._get_random_system_information(expected_type, rng)
             used_sysinfo.append(sysinfo)
             
             # 替换第一个出现的$sysInfo$
             payload = payload.replace('$sysInfo$', sysinfo, 1)
         
-        # 2. 替换 $sample$ 占位符
+        plan = FillPlan(template=payload, information_features=template.get('information_features'), verbose=verbose, rng=rng)
         # 如果有$sample$，使用最后一个系统信息的样本值
         if '$sample$' in payload and used_sysinfo:
-            sample_value = self._select_sample_for_system_information(used_sysinfo[-1])
+            plan.system_information = used_sysinfo[-1]
+        return plan
+    
+    def fetch_samples(self, plan: FillPlan, debug=False):
+        """查询 $sample$ 需要的系统信息取值"""
+        if plan.system_information is not None:
+            plan.sample_value = self._select_sample_for_system_information(plan.system_information, plan)
+    
+    def render(self, plan: FillPlan, debug=False) -> str:
+        """替换 $sample$ 和其余常量占位符"""
+        payload = plan.template
+        
+        # 2. 替换 $sample$ 占位符
+        if plan.system_information is not None:
+            sample_value = plan.sample_value
             # 如果sample_value是字符串类型（非纯数字），需要加引号
             if sample_value and not sample_value.replace('.', '').replace('-', '').isdigit():
                 sample_value = f"'{sample_value}'"
@@ -865,31 +1984,31 @@ class SystemInformationTemplateFiller:
         # 3. 替换其他占位符
         # 替换 $int$
         while '$int$' in payload:
-            payload = payload.replace('$int$', GetRandomAttribute.random_int_number(), 1)
+            payload = payload.replace('$int$', GetRandomAttribute.random_int_number(rng=plan.rng), 1)
         
         # 替换 $float$
         while '$float$' in payload:
-            payload = payload.replace('$float$', GetRandomAttribute.random_float_number(), 1)
+            payload = payload.replace('$float$', GetRandomAttribute.random_float_number(rng=plan.rng), 1)
         
         # 替换 $hex$
         while '$hex$' in payload:
-            payload = payload.replace('$hex$', GetRandomAttribute.random_hex_number(), 1)
+            payload = payload.replace('$hex$', GetRandomAttribute.random_hex_number(rng=plan.rng), 1)
         
         # 替换 $time$
         while '$time$' in payload:
-            payload = payload.replace('$time$', f"'{GetRandomAttribute.random_time()}'", 1)
+            payload = payload.replace('$time$', f"'{GetRandomAttribute.random_time(rng=plan.rng)}'", 1)
         
         # 替换 $date$
         while '$date$' in payload:
-            payload = payload.replace('$date$', f"'{GetRandomAttribute.random_date()}'", 1)
+            payload = payload.replace('$date$', f"'{GetRandomAttribute.random_date(rng=plan.rng)}'", 1)
         
         # 替换 $character$ (注意：原来是 #character$，现在统一为 $character$)
         while '$character$' in payload:
-            payload = payload.replace('$character$', f"'{GetRandomAttribute.random_character()}'", 1)
+            payload = payload.replace('$character$', f"'{GetRandomAttribute.random_character(rng=plan.rng)}'", 1)
         
         # 兼容旧格式 #character$
         while '#character$' in payload:
-            payload = payload.replace('#character$', f"'{GetRandomAttribute.random_character()}'", 1)
+            payload = payload.replace('#character$', f"'{GetRandomAttribute.random_character(rng=plan.rng)}'", 1)
         
         return payload
     
@@ -901,35 +2020,1077 @@ class SystemInformationTemplateFiller:
             连接是否成功
         """
         try:
-            connection = pymysql.connect(
-                host=self.mysql_config['host'],
-                port=self.mysql_config['port'],
-                user=self.mysql_config['user'],
-                password=self.mysql_config['password'],
-                database=self.mysql_config['database'],
-                charset=self.mysql_config.get('charset', 'utf8mb4')
-            )
-            connection.close()
-            print(f"✓ MySQL 连接成功: {self.mysql_config['host']}:{self.mysql_config['port']}/{self.mysql_config['database']}")
+            self.backend.ping(self.db_name)
+            print(f"✓ 连接成功: {self.backend.describe(self.db_name)}")
             return True
         except Exception as e:
-            print(f"✗ MySQL 连接失败: {e}")
+            print(f"✗ 连接失败: {e}")
             return False
 
+class ParquetExampleWriter:
+    """
+    以 Parquet 格式分批写出注入样本
+    
+    按 set 和 difficulty 以 hive 风格分区（set=train/difficulty=hard/<part_name>.parquet），
+    每个分区保持一个写入器，缓冲满 batch_size 行后写出一个 row group。
+    每个写入器使用自己的文件名（part_name），多个分片可以写入同一个数据集目录而不互相覆盖；
+    文件名由分片名或输出名确定，重复运行时先删除同名的旧文件，不会留下重复的行。
+    类别型列使用字典编码，下游可直接用 pyarrow.dataset 按分区过滤和内存映射读取。
+    """
+    
+    DICTIONARY_COLUMNS = ['db', 'payload_type', 'information_features']
+    NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+    
+    def __init__(self, output_dir: str, raw_sqls: List[Dict] | None = None, payloads: List[Dict] | None = None,
+                 batch_size: int = 10000, part_name: str = "part-0"):
+        """
+        Args:
+            output_dir: 数据集根目录
+            raw_sqls: 生成时使用的原始SQL列表（只用 write_record 写出展开后的样本时可以不提供）
+            payloads: 生成时使用的载荷模板列表
+            batch_size: 每个分区每次写出的行数
+            part_name: 各分区中的文件名（不含扩展名），同时写入同一目录的写入器必须使用不同的名字；
+                创建时删除所有分区中的同名文件
+        """
+        if pa is None:
+            raise ImportError("导出 Parquet 需要安装 pyarrow")
+        self.output_dir = output_dir
+        self.raw_sqls = raw_sqls
+        self.payloads = payloads
+        self.batch_size = batch_size
+        self.part_name = part_name
+        self.remove_parts(output_dir, glob.escape(part_name))
+        
+        dictionary_type = pa.dictionary(pa.int32(), pa.string())
+        self.schema = pa.schema([
+            ('sql', pa.string()),
+            ('original_sql', pa.string()),
+            ('db', dictionary_type),
+            ('annotator', pa.bool_()),
+            ('payload_template', pa.string()),
+            ('payload_type', dictionary_type),
+            ('information_features', dictionary_type),
+            ('payload', pa.string()),
+            ('label', pa.bool_()),
+            ('comment', pa.bool_()),
+            ('sample_fallback', pa.bool_())
+        ])
+        
+        self._buffers = {}  # {(set, difficulty): {column: [值, ...]}}
+        self._writers = {}  # {(set, difficulty): pq.ParquetWriter}
+    
+    @staticmethod
+    def remove_parts(output_dir: str, pattern: str):
+        """删除数据集所有分区中文件名（不含扩展名）匹配 glob 模式 pattern 的文件"""
+        for path in glob.glob(os.path.join(glob.escape(output_dir), "set=*", "difficulty=*", f"{pattern}.parquet")):
+            os.remove(path)
+    
+    def write(self, example: InjectionExample):
+        """缓冲一个样本，所在分区满 batch_size 行时写出"""
+        self._append(example.sql, self.raw_sqls[example.original_sql_id], self.payloads[example.payload_template_id],
+                     example.payload, example.label, example.comment, example.difficulty, example.sample_fallback)
+    
+    def write_record(self, record: Dict[str, Any]):
+        """缓冲一个展开后的样本字典（InjectionExample.to_dict 的格式，如分片和合并文件中的样本）"""
+        self._append(record['sql'], record['original_sql'], record['payload_template'], record['payload'],
+                     record['label'], record['comment'], record['difficulty'], record.get('sample_fallback', False))
+    
+    def _append(self, sql, sql_example, payload_template, payload, label, comment, difficulty, sample_fallback):
+        partition = (sql_example.get('set') or self.NULL_PARTITION, difficulty or self.NULL_PARTITION)
+        
+        buffer = self._buffers.setdefault(partition, {name: [] for name in self.schema.names})
+        buffer['sql'].append(sql)
+        buffer['original_sql'].append(sql_example['sql'])
+        buffer['db'].append(sql_example.get('db'))
+        buffer['annotator'].append(bool(sql_example.get('annotator')))
+        buffer['payload_template'].append(payload_template['payload'])
+        buffer['payload_type'].append(payload_template.get('type'))
+        buffer['information_features'].append(payload_template.get('information_features'))
+        buffer['payload'].append(payload)
+        buffer['label'].append(label)
+        buffer['comment'].append(comment)
+        buffer['sample_fallback'].append(sample_fallback)
+        
+        if len(buffer['sql']) >= self.batch_size:
+            self._flush(partition)
+    
+    def _flush(self, partition):
+        buffer = self._buffers.pop(partition, None)
+        if not buffer or not buffer['sql']:
+            return
+        
+        arrays = []
+        for name in self.schema.names:
+            if name in self.DICTIONARY_COLUMNS:
+                arrays.append(pa.array(buffer[name], type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(buffer[name], type=self.schema.field(name).type))
+        table = pa.Table.from_arrays(arrays, schema=self.schema)
+        
+        writer = self._writers.get(partition)
+        if writer is None:
+            set_name, difficulty = partition
+            partition_dir = os.path.join(self.output_dir, f"set={set_name}", f"difficulty={difficulty}")
+            os.makedirs(partition_dir, exist_ok=True)
+            writer = pq.ParquetWriter(os.path.join(partition_dir, f"{self.part_name}.parquet"), self.schema)
+            self._writers[partition] = writer
+        writer.write_table(table)
+    
+    def close(self):
+        """写出所有剩余缓冲并关闭文件"""
+        for partition in list(self._buffers):
+            self._flush(partition)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class JsonlExampleWriter:
+    """以 JSONL 格式逐行写出注入样本（接口与 ParquetExampleWriter 相同，不缓冲样本）"""
+    
+    def __init__(self, output_path: str, raw_sqls: List[Dict], payloads: List[Dict]):
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        self.raw_sqls = raw_sqls
+        self.payloads = payloads
+        self._file = open(output_path, 'w', encoding='utf-8')
+    
+    def write(self, example: InjectionExample):
+        self._file.write(json.dumps(example.to_dict(self.raw_sqls, self.payloads), ensure_ascii=False) + "\n")
+    
+    def close(self):
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class LazyJsonArray:
+    """
+    按需读取的 JSON 数组文件，可以代替 list 作为语料使用
+    
+    打开时扫描一遍文件，只记录每个顶层元素的字节区间（每条记录 16 字节）；
+    按下标访问时用 pread 读取并解析该元素，最近用到的 cache_size 条保留在内存中。
+    数组元素须为对象、数组或字符串（语料文件都是对象数组）。
+    支持 len、下标、迭代，以及用 where 按条件筛选出共享同一文件的子视图。
+    """
+    
+    _TOKEN_PATTERN = re.compile(rb'["\\\[\]{},]')
+    
+    def __init__(self, path: str, offsets: array | None = None, cache_size: int = 1024):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        self._offsets = offsets if offsets is not None else self._build_index(path)  # [start0, end0, start1, end1, ...]
+        self.cache_size = cache_size
+        self._load = lru_cache(maxsize=cache_size)(self._read)
+    
+    @classmethod
+    def _build_index(cls, path: str, chunk_size: int = 1 << 20) -> array:
+        offsets = array('Q')
+        depth = 0
+        in_string = False
+        skip_until = 0   # 字符串中转义字符之后的一个字节
+        element_start = None
+        position = 0
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                for match in cls._TOKEN_PATTERN.finditer(chunk):
+                    pos = position + match.start()
+                    if pos < skip_until:
+                        continue
+                    token = match.group()
+                    if in_string:
+                        if token == b'\\':
+                            skip_until = pos + 2
+                        elif token == b'"':
+                            in_string = False
+                        continue
+                    if depth == 1 and element_start is None and token not in (b',', b']'):
+                        element_start = pos
+                    if token == b'"':
+                        in_string = True
+                    elif token in (b'[', b'{'):
+                        depth += 1
+                    elif token in (b']', b'}'):
+                        depth -= 1
+                        if depth == 0 and element_start is not None:
+                            offsets.extend((element_start, pos))
+                            element_start = None
+                    elif token == b',' and depth == 1:
+                        if element_start is not None:
+                            offsets.extend((element_start, pos))
+                        element_start = None
+                position += len(chunk)
+        return offsets
+    
+    def _read(self, index: int) -> Any:
+        start, end = self._offsets[2 * index], self._offsets[2 * index + 1]
+        return json.loads(os.pread(self._fd, end - start, start))
+    
+    def __reduce__(self):
+        # 传给工作进程时只传文件路径和字节区间，在对方进程中重新打开
+        return (LazyJsonArray, (self.path, self._offsets, self.cache_size))
+    
+    def __len__(self) -> int:
+        return len(self._offsets) // 2
+    
+    def __getitem__(self, index: int) -> Any:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._load(index)
+    
+    def __iter__(self):
+        # 顺序遍历不经过缓存，避免把热点记录挤出去
+        for index in range(len(self)):
+            yield self._read(index)
+    
+    def where(self, predicate) -> 'LazyJsonArray':
+        """按条件筛选出子视图（只复制字节区间）"""
+        offsets = array('Q')
+        for index in range(len(self)):
+            if predicate(self._read(index)):
+                offsets.extend(self._offsets[2 * index:2 * index + 2])
+        return LazyJsonArray(self.path, offsets, self.cache_size)
+
+class LLMBudgetExceededError(Exception):
+    """LLM 花费已达到预算"""
+
+class TokenBucket:
+    """按分钟配额匀速补充的令牌桶"""
+    
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._tokens = per_minute
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, amount: float = 1):
+        """阻塞直到取到 amount 个令牌（超过桶容量时按容量计）"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            sleep(wait)
+
+class RateLimitedLLMClient:
+    """
+    限速、并发、带花费统计的 LLM 客户端
+    
+    每次请求先按 requests_per_minute 和 tokens_per_minute 两个令牌桶限速，再交给
+    有界线程池执行；遇到限流错误（429）按指数退避重试。累计 token 和花费，
+    达到预算后拒绝新请求并抛出 LLMBudgetExceededError。
+    
+    底层接口只返回文本，token 数按字符数估算。
+    """
+    
+    RATE_LIMIT_MARKERS = ('429', 'rate limit', 'ratelimit', 'too many requests')
+    
+    def __init__(self, llm, model: str = "gpt-4",
+                 requests_per_minute: float = 60, tokens_per_minute: float = 40000,
+                 max_workers: int = 8, max_retries: int = 5,
+                 backoff_base: float = 2.0, backoff_max: float = 60.0,
+                 expected_completion_tokens: int = 200,
+                 prompt_price_per_1k: float = 0.03, completion_price_per_1k: float = 0.06,
+                 budget: float | None = None):
+        """
+        Args:
+            llm: 提供 generate_by_hkust(prompt, model) 的底层客户端
+            model: 模型名
+            requests_per_minute / tokens_per_minute: 每分钟请求数和 token 数上限
+            max_workers: 并发请求数上限
+            max_retries: 限流错误的最大重试次数
+            backoff_base / backoff_max: 退避时间的基数和上限（秒）
+            expected_completion_tokens: 限速时为回复预留的 token 数
+            prompt_price_per_1k / completion_price_per_1k: 每千 token 价格
+            budget: 花费上限，None 表示不限制
+        """
+        self.llm = llm
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.expected_completion_tokens = expected_completion_tokens
+        self.prompt_price_per_1k = prompt_price_per_1k
+        self.completion_price_per_1k = completion_price_per_1k
+        self.budget = budget
+        
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """粗略估算 token 数（约 4 个字符一个 token）"""
+        return max(1, len(text) // 4)
+    
+    def _is_rate_limited(self, error: Exception) -> bool:
+        message = str(error).lower()
+        return getattr(error, 'status_code', None) == 429 or any(marker in message for marker in self.RATE_LIMIT_MARKERS)
+    
+    def _check_budget(self):
+        if self.budget is not None:
+            with self._lock:
+                cost = self._usage['cost']
+            if cost >= self.budget:
+                raise LLMBudgetExceededError(f"LLM 花费 {cost:.4f} 已达到预算 {self.budget}")
+    
+    def _call(self, prompt: str) -> str:
+        self._check_budget()
+        prompt_tokens = self.estimate_tokens(prompt)
+        
+        for attempt in range(self.max_retries + 1):
+            self._request_bucket.acquire(1)
+            self._token_bucket.acquire(prompt_tokens + self.expected_completion_tokens)
+            try:
+                response = self.llm.generate_by_hkust(prompt=prompt, model=self.model)
+                break
+            except Exception as e:
+                if not self._is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                run_stats.increment('llm_rate_limited')
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                sleep(delay * random.uniform(0.5, 1.0))
+        
+        completion_tokens = self.estimate_tokens(str(response))
+        with self._lock:
+            self._usage['requests'] += 1
+            self._usage['prompt_tokens'] += prompt_tokens
+            self._usage['completion_tokens'] += completion_tokens
+            self._usage['cost'] += (prompt_tokens * self.prompt_price_per_1k
+                                    + completion_tokens * self.completion_price_per_1k) / 1000
+        return response
+    
+    def submit(self, prompt: str):
+        """异步提交请求，返回 Future"""
+        self._check_budget()
+        return self._pool.submit(self._call, prompt)
+    
+    def generate(self, prompt: str) -> str:
+        """同步请求（同样经过限速和并发控制）"""
+        return self.submit(prompt).result()
+    
+    def usage(self) -> Dict[str, Any]:
+        """累计的请求数、token 数和花费"""
+        with self._lock:
+            return dict(self._usage)
+    
+    def add_usage(self, usage: Dict[str, Any]):
+        """累加其他客户端（如工作进程中的客户端）的用量"""
+        with self._lock:
+            for name, amount in usage.items():
+                self._usage[name] = self._usage.get(name, 0) + amount
+    
+    def split(self, parts: int) -> 'RateLimitedLLMClient':
+        """
+        创建限速、并发数和剩余预算都是本客户端 1/parts 的新客户端
+        
+        多进程生成时每个工作进程使用一个，合计不超过本客户端的配额。
+        """
+        budget = None if self.budget is None else max(self.budget - self.usage()['cost'], 0.0) / parts
+        return RateLimitedLLMClient(self.llm, self.model, self.requests_per_minute / parts, self.tokens_per_minute / parts,
+                                    max(1, self.max_workers // parts), self.max_retries, self.backoff_base, self.backoff_max,
+                                    self.expected_completion_tokens, self.prompt_price_per_1k, self.completion_price_per_1k, budget)
+    
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+class PromptCache:
+    """
+    提示词模板的预渲染缓存
+    
+    模板只加载、编译一次。每个 (payload_type, payload_template) 第一次出现时用占位
+    标记代替 payload 渲染一次，按标记切分成静态片段并缓存；之后只需把 payload 拼进
+    片段之间，不再渲染模板，也没有文件 I/O。若模板对 payload 做了转换导致找不到
+    标记，则退回到每次完整渲染。
+    """
+    
+    PAYLOAD_MARKER = "\ue000PAYLOAD\ue000"
+    
+    def __init__(self, template_dir: str, template_name: str):
+        self.template_dir = template_dir
+        self.template_name = template_name
+        self._template = None
+        self._parts = {}  # {cache_key: [静态片段, ...] 或 None（无法预渲染）}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def cache_key(payload_type: str, payload_template: str) -> str:
+        """预渲染片段的缓存键，也可用作下游响应缓存键的前缀"""
+        return hashlib.sha1(json.dumps([payload_type, payload_template], ensure_ascii=False).encode('utf-8')).hexdigest()
+    
+    @property
+    def template(self):
+        if self._template is None:
+            with self._lock:
+                if self._template is None:
+                    self._template = load_prompt_template(self.template_dir, self.template_name)
+        return self._template
+    
+    def render(self, payload_type: str, payload_template: str, payload: str) -> str:
+        key = self.cache_key(payload_type, payload_template)
+        if key not in self._parts:
+            rendered = self.template.render(payload_type=payload_type, payload_template=payload_template,
+                                            payload=self.PAYLOAD_MARKER)
+            self._parts[key] = rendered.split(self.PAYLOAD_MARKER) if self.PAYLOAD_MARKER in rendered else None
+        
+        parts = self._parts[key]
+        if parts is None:
+            return self.template.render(payload_type=payload_type, payload_template=payload_template, payload=payload)
+        return payload.join(parts)
+
+# 合法的顶层语句类型。sqlglot 遇到不认识的语句会退化为 Command（如 DROP TABLEX foo），
+# 拼写错误的关键字也可能被解析成别名等表达式（如 SELEC * FORM x），这两种都视为错误
+_SQL_STATEMENT_TYPES = tuple(
+    getattr(sqlglot_exp, name) for name in (
+        'Query', 'DML', 'DDL', 'Insert', 'Update', 'Delete', 'Drop', 'Alter', 'TruncateTable',
+        'Describe', 'Show', 'Set', 'Use', 'Transaction', 'Commit', 'Rollback', 'Kill', 'Merge', 'LoadData', 'Analyze'
+    ) if hasattr(sqlglot_exp, name)
+) if sqlglot_exp else ()
+
+def _parse_sql(sql: str) -> str | None:
+    """用 sqlglot 按 MySQL 方言解析，返回错误信息（在进程池或当前进程中执行）"""
+    try:
+        statements = sqlglot.parse(sql, read="mysql")
+    except SqlglotError as e:
+        return str(e).splitlines()[0]
+    for statement in statements:
+        if statement is None:
+            continue
+        if isinstance(statement, sqlglot_exp.Command) or not isinstance(statement, _SQL_STATEMENT_TYPES):
+            return f"无法识别的语句: {statement.sql(dialect='mysql')[:80]}"
+    return None
+
+class SQLValidator:
+    """
+    生成结果的语法校验
+    
+    - parser: 用 sqlglot（MySQL 方言）解析，在进程池中执行，不占用生成线程的 GIL。
+      进程池在创建校验器时就启动，应在开始生成（启动其他线程）之前创建
+    - explain: 通过样本后端在数据库上 EXPLAIN（需要 MySQL 后端），一批 SQL 共用一个连接
+    
+    生成时按批调用 validate_many（见 validate_batch），进程池往返和数据库连接按批摊销。
+    
+    结果按 SQL 的形状缓存：字符串和数字字面量替换为 ?、空白合并、统一小写，
+    只是取值不同的 SQL 只校验一次。
+    """
+    
+    _LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|\b0x[0-9a-fA-F]+\b|\b\d+(?:\.\d+)?\b")
+    
+    def __init__(self, mode: str = "parser", workers: int = 2, backend: SampleBackend | None = None, cache_size: int = 100_000):
+        """
+        Args:
+            mode: parser 或 explain
+            workers: parser 模式的进程数，0 表示在当前进程中解析（用于本身已在工作进程中的情况）
+            backend: explain 模式使用的样本后端
+            cache_size: 缓存的形状数上限，超过后清空重新缓存，避免长时间运行时内存持续增长
+        """
+        if mode == "parser" and sqlglot is None:
+            raise ImportError("parser 校验需要安装 sqlglot")
+        if mode == "explain" and (backend is None or type(backend).explain is SampleBackend.explain):
+            raise ValueError("explain 校验需要 MySQL 后端（--backend pymysql）")
+        if mode not in ("parser", "explain"):
+            raise ValueError(f"未知的校验方式: {mode}")
+        self.mode = mode
+        self.workers = workers
+        self.backend = backend
+        self.cache_size = cache_size
+        self._cache = {}  # {(数据库, 形状): 错误信息或 None}
+        self._lock = threading.Lock()
+        self._executor = None
+        if mode == "parser" and workers > 0:
+            # fork 只复制当前线程，其他线程持有的锁在子进程中永远不会释放；
+            # 已有其他线程时改用 forkserver，从干净的服务进程启动工作进程
+            context = None
+            if threading.active_count() > 1 and "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+            self._executor = ProcessPoolExecutor(workers, mp_context=context)
+            # 提交一个任务让进程池立即启动工作进程，而不是等到生成过程中第一次校验
+            self._executor.submit(_parse_sql, "SELECT 1").result()
+    
+    @classmethod
+    def sql_shape(cls, sql: str) -> str:
+        return ' '.join(cls._LITERAL_PATTERN.sub('?', sql).split()).lower()
+    
+    def _cache_key(self, sql: str, db_name: str | None):
+        # 语法解析与数据库无关；EXPLAIN 的结果取决于数据库中的表和列
+        return (db_name if self.mode == "explain" else None, self.sql_shape(sql))
+    
+    def validate_many(self, sqls: List[str], db_names: List[str | None] | None = None) -> List[str | None]:
+        """
+        批量校验，未命中缓存的形状去重后一起校验
+        
+        Returns:
+            每条 SQL 的错误信息，合法的为 None
+        """
+        db_names = db_names or [None] * len(sqls)
+        keys = [self._cache_key(sql, db_name) for sql, db_name in zip(sqls, db_names)]
+        pending = {}  # key -> 代表 SQL
+        results = {}
+        with self._lock:
+            for key, sql in zip(keys, sqls):
+                if key in self._cache:
+                    run_stats.increment('validation_cache_hits')
+                    results[key] = self._cache[key]
+                elif key not in pending:
+                    pending[key] = sql
+        
+        if pending:
+            if self.mode == "parser" and self.workers == 0:
+                checked = {key: _parse_sql(sql) for key, sql in pending.items()}
+            elif self.mode == "parser":
+                errors = list(self._executor.map(_parse_sql, pending.values(), chunksize=max(1, len(pending) // (self.workers * 4))))
+                checked = dict(zip(pending, errors))
+            else:
+                checked = {}
+                by_db = {}
+                for key, sql in pending.items():
+                    by_db.setdefault(key[0], []).append((key, sql))
+                for db_name, items in by_db.items():
+                    errors = self.backend.explain(db_name, [sql for _, sql in items])
+                    checked.update(zip((key for key, _ in items), errors))
+            results.update(checked)
+            with self._lock:
+                if len(self._cache) + len(checked) > self.cache_size:
+                    self._cache.clear()
+                self._cache.update(checked)
+        
+        return [results[key] for key in keys]
+    
+    def validate(self, sql: str, db_name: str | None = None) -> str | None:
+        return self.validate_many([sql], [db_name])[0]
+    
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+@dataclass(slots=True)
+class GenerationContext:
+    """一次生成运行中所有样本共用的输入"""
+    db_schemas: List[Dict]
+    sys_schemas: List[Dict]
+    system_vars: List[Dict]
+    comment_rate: float
+    feasibility: 'FeasibilityMatrix | None' = None
+    validator: SQLValidator | None = None
+    verbose: bool = True  # 逐条打印被拒绝和跳过的样本；有进度报告时关闭
+
+@dataclass(slots=True)
+class GenerationJob:
+    """流水线中的一个样本，各阶段依次填充其字段"""
+    example_index: int | None
+    sql_id: int
+    payload_id: int | None
+    sql_example: Dict[str, Any]
+    payload_template: Dict[str, Any] | None
+    filler: Any = None
+    plan: FillPlan | None = None
+    raw_payload: str | None = None
+    payload: str | None = None
+    comment: bool = False
+    result: InjectionExample | None = None
+    skipped: bool = False  # 跳过后续阶段（数据库不可用、没有可选载荷或出错）
+    error: Exception | None = None
+    rng: Any = random  # 本样本所有随机选择使用的随机数生成器，指定 seed 时每个下标各有一个（见 select_jobs）
+
+def run_stage(name, stage, job, context, stop_on=(LLMBudgetExceededError,)):
+    """
+    执行一个阶段，顺序执行和流水线执行共用同一错误处理
+    
+    样本自身的错误只让该样本失败（job.skipped / job.error），计入 run_stats 后继续下一个样本；
+    stop_on 中的异常（如 LLM 预算耗尽）向上抛出，由调用方停止整个运行。
+    """
+    try:
+        stage(job, context)
+    except Exception as e:
+        job.skipped = True
+        job.error = e
+        if isinstance(e, stop_on):
+            raise
+        run_stats.increment('stage_errors')
+        if context.verbose:
+            print(f"  ⚠️  阶段 {name} 出错: {e}")
+
+class StagedPipeline:
+    """
+    分阶段的流式生成流水线
+    
+    每个阶段有独立的线程数，阶段之间用有界队列连接：I/O 阶段可以单独扩展线程，
+    下游变慢时上游阻塞在队列上（背压），在途样本数不超过队列容量之和，内存保持平稳。
+    某个阶段抛出 stop_on 中的异常（如 LLM 预算耗尽）时停止投递新样本，该样本也不再交给 sink。
+    样本来源（jobs 迭代器）出错时同样停止，已在途的样本处理完后在 run 中重新抛出该异常。
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, stages, context: GenerationContext, queue_size: int = 64,
+                 stop_on=(LLMBudgetExceededError,)):
+        """
+        Args:
+            stages: [(阶段名, 阶段函数(job, context), 线程数), ...]
+            context: 传给每个阶段函数的上下文
+            queue_size: 每个队列的容量
+            stop_on: 需要停止整个流水线的异常类型
+        """
+        self.stages = stages
+        self.context = context
+        self.queue_size = queue_size
+        self.stop_on = stop_on
+        self._stopped = threading.Event()
+        self._stop_lock = threading.Lock()
+        self._source_error = None
+    
+    def _source(self, jobs, output_queue):
+        try:
+            for job in jobs:
+                if self._stopped.is_set():
+                    break
+                output_queue.put(job)
+        except BaseException as e:
+            self._source_error = e
+        finally:
+            output_queue.put(self._STOP)
+    
+    def _worker(self, name, stage, input_queue, output_queue, remaining):
+        while True:
+            job = input_queue.get()
+            if job is self._STOP:
+                # 让同一阶段的其他线程也能收到结束标记，最后一个退出的线程再通知下游
+                input_queue.put(self._STOP)
+                with remaining['lock']:
+                    remaining['count'] -= 1
+                    last = remaining['count'] == 0
+                if last:
+                    output_queue.put(self._STOP)
+                return
+            if not job.skipped:
+                try:
+                    run_stage(name, stage, job, self.context, self.stop_on)
+                except self.stop_on as e:
+                    # 被迫停止的样本没有完成，不交给下游（与顺序执行时一致）
+                    # 在途的其他样本也会陆续抛出同样的异常，只提示一次
+                    with self._stop_lock:
+                        first = not self._stopped.is_set()
+                        self._stopped.set()
+                    if first:
+                        print(f"⚠️  停止生成: {e}")
+                    continue
+            output_queue.put(job)
+    
+    def run(self, jobs, sink):
+        """
+        执行流水线，在当前线程中把每个完成的样本交给 sink(job)（完成顺序，不保证下标顺序）
+        
+        Raises:
+            jobs 迭代器抛出的异常（在途样本处理完之后）
+        """
+        queues = [Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._source, args=(jobs, queues[0]), daemon=True)]
+        for i, (name, stage, workers) in enumerate(self.stages):
+            remaining = {'count': max(1, workers), 'lock': threading.Lock()}
+            for _ in range(max(1, workers)):
+                threads.append(threading.Thread(
+                    target=self._worker, args=(name, stage, queues[i], queues[i + 1], remaining),
+                    name=f"stage-{name}", daemon=True
+                ))
+        for thread in threads:
+            thread.start()
+        
+        while True:
+            job = queues[-1].get()
+            if job is self._STOP:
+                break
+            sink(job)
+        
+        for thread in threads:
+            thread.join()
+        if self._source_error is not None:
+            raise self._source_error
+
+class ProgressReporter:
+    """
+    生成进度报告
+    
+    每处理完一个样本调用一次 record，每隔 interval 秒向终端（stderr）输出一行进度，
+    并把完整状态原子地写入 status_path（JSON），供外部轮询。
+    速度和剩余时间按最近 window 秒的滑动窗口计算，能反映限流、熔断等造成的速度变化。
+    """
+    
+    def __init__(self, total: int, interval: float = 10.0, status_path: str | None = None,
+                 window: float = 60.0, stream=None):
+        """
+        Args:
+            total: 需要处理的样本数
+            interval: 输出间隔（秒）
+            status_path: JSON 状态文件路径，None 表示不写
+            window: 计算速度的滑动窗口（秒）
+            stream: 终端输出流，默认 sys.stderr
+        """
+        self.total = total
+        self.interval = interval
+        self.status_path = status_path
+        self.window = window
+        self.stream = stream if stream is not None else sys.stderr
+        self.started_at = monotonic()
+        self.done = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.fallbacks = 0
+        self.strata = {}  # {difficulty: 通过的样本数}
+        self._history = deque([(self.started_at, 0)])  # (时间, 已处理数)
+        self._last_emit = self.started_at
+        self._lock = threading.Lock()
+    
+    def record(self, job: 'GenerationJob'):
+        with self._lock:
+            self.done += 1
+            if job.result is not None:
+                self.accepted += 1
+                # identify_difficulty 对部分组合（如无标注者但有注释）返回 None
+                difficulty = job.result.difficulty or "unknown"
+                self.strata[difficulty] = self.strata.get(difficulty, 0) + 1
+                if job.result.sample_fallback:
+                    self.fallbacks += 1
+            elif job.skipped:
+                self.skipped += 1
+            else:
+                self.rejected += 1
+            
+            now = monotonic()
+            # 每秒最多记一个点，窗口内的点数与生成速度无关
+            if now - self._history[-1][0] >= 1.0:
+                self._history.append((now, self.done))
+            while len(self._history) > 2 and now - self._history[1][0] >= self.window:
+                self._history.popleft()
+            due = now - self._last_emit >= self.interval
+            if due:
+                self._last_emit = now
+        if due:
+            self.emit()
+    
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            now = monotonic()
+            elapsed = now - self.started_at
+            (oldest_at, oldest_done) = self._history[0]
+            rate = (self.done - oldest_done) / (now - oldest_at) if now > oldest_at else 0.0
+            remaining = max(self.total - self.done, 0)
+            return {
+                "total": self.total,
+                "done": self.done,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "skipped": self.skipped,
+                "progress": self.done / self.total if self.total else 1.0,
+                "elapsed": elapsed,
+                "examples_per_sec": rate,
+                "overall_examples_per_sec": self.done / elapsed if elapsed > 0 else 0.0,
+                "eta": remaining / rate if rate > 0 else None,
+                "rejection_rate": (self.rejected + self.skipped) / self.done if self.done else 0.0,
+                "fallback_rate": self.fallbacks / self.accepted if self.accepted else 0.0,
+                "strata": dict(self.strata),
+                "run_stats": run_stats.snapshot(),
+                "updated_at": datetime.now().isoformat(timespec='seconds')
+            }
+    
+    def emit(self, final: bool = False):
+        status = self.status()
+        status["finished"] = final
+        eta = f"{status['eta']:.0f}s" if status['eta'] is not None else "-"
+        strata = ' '.join(f"{name}={count}" for name, count in sorted(status['strata'].items()))
+        print(f"[进度] {status['done']}/{status['total']} ({status['progress']:.1%}) "
+              f"{status['examples_per_sec']:.1f} 条/秒 ETA {eta} | "
+              f"通过 {status['accepted']} 拒绝 {status['rejected']} 跳过 {status['skipped']} "
+              f"兜底 {status['fallback_rate']:.1%} | {strata}", file=self.stream, flush=True)
+        if self.status_path:
+            os.makedirs(os.path.dirname(self.status_path) or ".", exist_ok=True)
+            with open(self.status_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(status, f, ensure_ascii=False, indent=2)
+            os.replace(self.status_path + ".tmp", self.status_path)
+    
+    def finish(self):
+        self.emit(final=True)
+
+class SamplingProfiler:
+    """
+    采样式性能分析器
+    
+    后台线程每隔 interval 秒读取所有线程的调用栈（sys._current_frames），
+    同时读取每个线程的 CPU 时钟：两次采样之间的墙钟时间记到该调用栈的 wall，
+    线程实际消耗的 CPU 时间记到 cpu，两者之差就是阻塞在 I/O（数据库、LLM）或锁上的时间。
+    调用栈以线程名开头（流水线阶段线程名为 stage-<阶段名>），便于判断应该扩展哪个阶段。
+    
+    只采样主线程和流水线阶段线程：蓄水池刷新、LLM 线程池等后台线程大部分时间停在
+    Event.wait 上，计入的话会把空闲误报成 I/O。阶段线程在阶段之间的队列上等待
+    （上游没有样本或下游已满）也不是在做事，这部分时间单独记为 idle。
+    """
+    
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.wall = {}  # 调用栈元组 -> 秒
+        self.cpu = {}
+        self.idle = {}  # 线程名 -> 在流水线队列上等待的秒数
+        self.samples = 0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._cpu_clocks = {}  # 线程 ident -> 上次读取的 CPU 时间
+    
+    @staticmethod
+    def _frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+    
+    def _thread_cpu_time(self, ident):
+        if pthread_getcpuclockid is None:
+            return None
+        try:
+            return clock_gettime(pthread_getcpuclockid(ident))
+        except (OSError, OverflowError):  # 线程已退出
+            return None
+    
+    @staticmethod
+    def _is_profiled_thread(ident, name) -> bool:
+        return ident == threading.main_thread().ident or name.startswith("stage-")
+    
+    def _sample(self, wall_delta):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident, f"thread-{ident}")
+            if not self._is_profiled_thread(ident, name):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_label(frame))
+                frame = frame.f_back
+            stack.append(name)
+            stack = tuple(reversed(stack))
+            
+            if any(label.startswith("queue.py:") for label in stack):
+                self.idle[name] = self.idle.get(name, 0.0) + wall_delta
+                self._cpu_clocks[ident] = self._thread_cpu_time(ident)
+                continue
+            
+            cpu_now = self._thread_cpu_time(ident)
+            # 第一次见到的线程是在上次采样之后启动的，它的全部 CPU 时间都属于这个间隔
+            cpu_before = self._cpu_clocks.get(ident, 0.0)
+            self._cpu_clocks[ident] = cpu_now
+            cpu_delta = min(max(cpu_now - cpu_before, 0.0), wall_delta) if cpu_now is not None and cpu_before is not None else 0.0
+            
+            self.wall[stack] = self.wall.get(stack, 0.0) + wall_delta
+            self.cpu[stack] = self.cpu.get(stack, 0.0) + cpu_delta
+        self.samples += 1
+    
+    def _run(self):
+        last = monotonic()
+        while not self._stop.wait(self.interval):
+            now = monotonic()
+            self._sample(now - last)
+            self.elapsed += now - last
+            last = now
+    
+    def start(self):
+        self._stop.clear()
+        self._cpu_clocks = {thread.ident: self._thread_cpu_time(thread.ident) for thread in threading.enumerate()}
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+    
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        按函数汇总（inclusive 含子调用，self 只算栈顶），按 inclusive 墙钟时间降序
+        """
+        functions = {}
+        for stack, wall in self.wall.items():
+            cpu = self.cpu.get(stack, 0.0)
+            for depth, label in enumerate(stack[1:], start=1):
+                entry = functions.setdefault(label, {"function": label, "wall": 0.0, "cpu": 0.0, "self_wall": 0.0, "self_cpu": 0.0})
+                # 递归函数在同一调用栈中只计一次 inclusive 时间
+                if label not in stack[1:depth]:
+                    entry["wall"] += wall
+                    entry["cpu"] += cpu
+            if len(stack) > 1:
+                top = functions[stack[-1]]
+                top["self_wall"] += wall
+                top["self_cpu"] += cpu
+        for entry in functions.values():
+            entry["io_wait"] = entry["wall"] - entry["cpu"]
+        return sorted(functions.values(), key=lambda entry: entry["wall"], reverse=True)
+    
+    def write(self, output_prefix: str):
+        """
+        写出 <prefix>.wall.collapsed、<prefix>.cpu.collapsed（flamegraph.pl / speedscope 可直接读取，单位微秒）
+        和 <prefix>.summary.json
+        """
+        os.makedirs(os.path.dirname(output_prefix) or ".", exist_ok=True)
+        for kind, stacks in (("wall", self.wall), ("cpu", self.cpu)):
+            with open(f"{output_prefix}.{kind}.collapsed", 'w', encoding='utf-8') as f:
+                for stack, seconds in sorted(stacks.items()):
+                    micros = int(seconds * 1_000_000)
+                    if micros > 0:
+                        f.write(f"{';'.join(stack)} {micros}\n")
+        with open(f"{output_prefix}.summary.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                "interval": self.interval,
+                "samples": self.samples,
+                "elapsed": self.elapsed,
+                "cpu_clock": pthread_getcpuclockid is not None,
+                "idle": self.idle,
+                "functions": self.summary()
+            }, f, ensure_ascii=False, indent=2)
+
+def record_key(record: Dict[str, Any]) -> str:
+    """输入记录的内容哈希（规范化 JSON 的 SHA-1）"""
+    return hashlib.sha1(json.dumps(record, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class FeasibilityMatrix:
+    """
+    载荷模板 × 数据库的可满足性矩阵（由 analyze 子命令离线生成）
+    
+    以载荷模板的内容哈希为键，记录可以填充它的业务数据库和系统库。
+    矩阵中没有的模板（分析之后新增的）视为全部可行。
+    """
+    
+    def __init__(self, matrix: Dict[str, Any]):
+        self.payloads = matrix.get('payloads', {})
+    
+    @classmethod
+    def load(cls, path: str) -> 'FeasibilityMatrix':
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+    
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'payloads': self.payloads}, f, ensure_ascii=False, indent=2)
+    
+    def is_feasible(self, payload_template: Dict[str, Any], db_name: str) -> bool:
+        entry = self.payloads.get(record_key(payload_template))
+        return entry is None or db_name in entry['databases']
+    
+    def feasible_system_schemas(self, payload_template: Dict[str, Any], sys_schemas: List[Dict]) -> List[Dict]:
+        entry = self.payloads.get(record_key(payload_template))
+        if entry is None:
+            return sys_schemas
+        return [schema for schema in sys_schemas if schema.get('database_name') in entry['system_schemas']]
+
+class InputManifest:
+    """
+    生成结果对应的输入清单，保存在输出文件旁边（<输出文件>.manifest.json）
+    
+    记录生成时每条 SQL 和载荷模板的内容哈希，以及平均每条 SQL、每个载荷模板分到的样本数。
+    增量生成时据此找出新增、修改和删除的输入记录。
+    """
+    
+    def __init__(self, manifest: Dict[str, Any]):
+        self.sqls = set(manifest.get('sqls', []))
+        self.payloads = set(manifest.get('payloads', []))
+        self.examples_per_sql = manifest.get('examples_per_sql', 0.0)
+        self.examples_per_payload = manifest.get('examples_per_payload', 0.0)
+    
+    @classmethod
+    def build(cls, raw_sqls: List[Dict], payloads: List[Dict], expected_exmaple_num: int) -> 'InputManifest':
+        return cls({
+            'sqls': [record_key(sql_example) for sql_example in raw_sqls],
+            'payloads': [record_key(payload_template) for payload_template in payloads],
+            'examples_per_sql': expected_exmaple_num / max(1, len(raw_sqls)),
+            'examples_per_payload': expected_exmaple_num / max(1, len(payloads))
+        })
+    
+    @classmethod
+    def from_examples(cls, examples: List[Dict[str, Any]]) -> 'InputManifest':
+        """没有清单的旧输出：用样本中出现过的输入记录近似（没有任何样本的记录会被当作新增）"""
+        sqls = {record_key(example['original_sql']) for example in examples}
+        payloads = {record_key(example['payload_template']) for example in examples}
+        return cls({
+            'sqls': sorted(sqls),
+            'payloads': sorted(payloads),
+            'examples_per_sql': len(examples) / max(1, len(sqls)),
+            'examples_per_payload': len(examples) / max(1, len(payloads))
+        })
+    
+    @staticmethod
+    def path_for(output_path: str) -> str:
+        return output_path + ".manifest.json"
+    
+    @classmethod
+    def load(cls, path: str) -> 'InputManifest':
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+    
+    def save(self, path: str):
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({
+                'sqls': sorted(self.sqls),
+                'payloads': sorted(self.payloads),
+                'examples_per_sql': self.examples_per_sql,
+                'examples_per_payload': self.examples_per_payload
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
 mysql_config = load_yaml_to_dict("config/database_connection.yaml")
+sample_store = None  # 多进程生成时由 attach_sample_store 在各工作进程中挂载
+sample_backend = None  # 为 None 时使用 mysql_config 对应的 MySQL 后端，可用 --backend 切换（见 create_sample_backend）
 gpt = LLM(api_key="37b6a23e010b4a1da5cec77107e0386b04f7c1e7544e4fb49dcb69686618125b", base_url=HKUST_BASE_URL)
+llm_client = RateLimitedLLMClient(gpt, model="gpt-4")
+comment_prompt_cache = PromptCache("prompt_templates", "prompt_for_generate_comment.j2")
 checker = SymbolChecker()
 raw_datas_dir = "data/data_for_generate_injection_sql"
 
+# 设置 INJECTION_SQL_LAZY_CORPORA=1 时语料按需从文件读取（见 LazyJsonArray），不整体载入内存
+lazy_corpora = os.environ.get("INJECTION_SQL_LAZY_CORPORA") == "1"
+load_corpus = LazyJsonArray if lazy_corpora else read_json_file
+
+def split_corpus(corpus, split_name):
+    if isinstance(corpus, LazyJsonArray):
+        return corpus.where(lambda item: item['set'] == split_name)
+    return [item for item in corpus if item['set'] == split_name]
+
 # 用于合成阳性样本的标记注入点后的阴性样本
-raw_sqls = read_json_file(f"{raw_datas_dir}/sql_data_with_injection_point.json")
-test_raw_sqls = [sql for sql in raw_sqls if sql['set'] == "test"]
-train_raw_sqls = [sql for sql in raw_sqls if sql['set'] == "train"]
+raw_sqls = load_corpus(f"{raw_datas_dir}/sql_data_with_injection_point.json")
+test_raw_sqls = split_corpus(raw_sqls, "test")
+train_raw_sqls = split_corpus(raw_sqls, "train")
 
 # test和train中的载荷
-payloads = read_json_file(f"{raw_datas_dir}/payloads.json")
-test_payloads = [payload for payload in payloads if payload['set'] == "test"]
-train_payloads = [payload for payload in payloads if payload['set'] == "train"]
+payloads = load_corpus(f"{raw_datas_dir}/payloads.json")
+test_payloads = split_corpus(payloads, "test")
+train_payloads = split_corpus(payloads, "train")
 
 # 真实数据库模式，系统数据库模式，系统变量
 db_schemas = read_json_file(f"{raw_datas_dir}/schema.json")
@@ -937,200 +3098,1146 @@ sys_schemas = read_json_file(f"{raw_datas_dir}/system_table_schema.json")
 system_vars = read_json_file(f"{raw_datas_dir}/system_var.json")
 comment_list = read_json_file(f"{raw_datas_dir}/comment_repository.json")
 
+# 离线生成的载荷模板 × 数据库可满足性矩阵（python generate_injection_sql.py analyze）
+feasibility_matrix_path = f"{raw_datas_dir}/feasibility_matrix.json"
 
-def pipeline(sql_example, payload_template, db_schemas, sys_schemas, system_vars, comment_rate):
-    
-    def identify_difficulty(annotator, comment, information_features):
-        if annotator and comment and information_features == "constant":
-            return "simple"
-        if annotator and not comment and information_features == "constant":
-            return "simple"
-        if not annotator and not comment and information_features == "constant":
-            return "simple"
-        
-        if annotator and comment and information_features == "system information":
-            return "medium"
-        if annotator and not comment and information_features == "system information":
-            return "medium"
-        if not annotator and not comment and information_features == "system information":
-            return "medium"
-        if annotator and not comment and information_features == "specific database":
-            return "medium"
-        
-        if annotator and comment and information_features == "specific database":
-            return "hard"
-        if not annotator and not comment and information_features == "specific database":
-            return "hard"
-    
-    def generate_comment(payload_type, payload_template, payload, comment_list):
-        comment_type_list = ["Rational explanation", "Irrelevant text dilution", "Authoritative statement"]
-        selected_type = random.choice(comment_type_list)
-        if selected_type == "Irrelevant text dilution":
-            selected_comment_list = [comment for comment in comment_list if comment['type'] == "Irrelevant text dilution"]
-            return random.choice(selected_comment_list)['comment']
-        if selected_type == "Authoritative statement":
-            selected_comment_list = [comment for comment in comment_list if comment['type'] == "Authoritative statement"]
-            return random.choice(selected_comment_list)['comment']
-        if selected_type == "Rational explanation":
-            prompt = load_prompt_template("prompt_templates", "prompt_for_generate_comment.j2").render(payload_type = payload_type, payload_template = payload_template, payload = payload)
-            return gpt.generate_by_hkust(prompt = prompt, model="gpt-4")
-
-    def insert_payload(sql, payload):
-        def remove_first_char(text):
-            """删除第一个字符"""
-            return text[1:] if text else text
-        
-        def insert_char_at_position(text, position, char):
-            """在指定位置插入字符"""
-            return text[:position] + char + text[position:]
-        
-        def remove_unnecessary_comments(sql_text):
-            """移除不必要的注释符
-            只在以下情况删除注释符：
-            1. 注释符是最后两个字符
-            2. 注释符后面只有空白字符（空格、制表符、换行等）
-            """
-            comment_matches = list(re.finditer(r'--', sql_text))
-            
-            if not comment_matches:
-                return sql_text
-            
-            # 从后往前处理，避免位置偏移问题
-            for match in reversed(comment_matches):
-                comment_pos = match.start()
-                comment_end = match.end()  # comment_end = comment_pos + 2
-                
-                # 情况1：注释符已经是最后两位
-                if comment_end >= len(sql_text):
-                    sql_text = sql_text[:comment_pos]
-                    continue
-                
-                # 情况2：注释符后面的内容
-                remaining_text = sql_text[comment_end:]
-                
-                # 只有当后面全是空白字符时才删除注释符
-                if remaining_text.strip() == '':  # 后面只有空白字符，没有实际内容
-                    sql_text = sql_text[:comment_pos]
-                # 如果后面有实际内容，保留注释符不做任何处理
-            
+
+def identify_difficulty(annotator, comment, information_features):
+    if annotator and comment and information_features == "constant":
+        return "simple"
+    if annotator and not comment and information_features == "constant":
+        return "simple"
+    if not annotator and not comment and information_features == "constant":
+        return "simple"
+
+    if annotator and comment and information_features == "system information":
+        return "medium"
+    if annotator and not comment and information_features == "system information":
+        return "medium"
+    if not annotator and not comment and information_features == "system information":
+        return "medium"
+    if annotator and not comment and information_features == "specific database":
+        return "medium"
+
+    if annotator and comment and information_features == "specific database":
+        return "hard"
+    if not annotator and not comment and information_features == "specific database":
+        return "hard"
+
+def generate_comment(payload_type, payload_template, payload, comment_list, rng=random):
+    comment_type_list = ["Rational explanation", "Irrelevant text dilution", "Authoritative statement"]
+    selected_type = rng.choice(comment_type_list)
+    if selected_type == "Irrelevant text dilution":
+        selected_comment_list = [comment for comment in comment_list if comment['type'] == "Irrelevant text dilution"]
+        return rng.choice(selected_comment_list)['comment']
+    if selected_type == "Authoritative statement":
+        selected_comment_list = [comment for comment in comment_list if comment['type'] == "Authoritative statement"]
+        return rng.choice(selected_comment_list)['comment']
+    if selected_type == "Rational explanation":
+        prompt = comment_prompt_cache.render(payload_type, payload_template, payload)
+        return llm_client.generate(prompt)
+
+def insert_payload(sql, payload):
+    def remove_first_char(text):
+        """删除第一个字符"""
+        return text[1:] if text else text
+
+    def insert_char_at_position(text, position, char):
+        """在指定位置插入字符"""
+        return text[:position] + char + text[position:]
+
+    def remove_unnecessary_comments(sql_text):
+        """移除不必要的注释符
+        只在以下情况删除注释符：
+        1. 注释符是最后两个字符
+        2. 注释符后面只有空白字符（空格、制表符、换行等）
+        """
+        comment_matches = list(re.finditer(r'--', sql_text))
+
+        if not comment_matches:
             return sql_text
-        
-        if not isinstance(sql, str) or not isinstance(payload, str):
+
+        # 从后往前处理，避免位置偏移问题
+        for match in reversed(comment_matches):
+            comment_pos = match.start()
+            comment_end = match.end()  # comment_end = comment_pos + 2
+
+            # 情况1：注释符已经是最后两位
+            if comment_end >= len(sql_text):
+                sql_text = sql_text[:comment_pos]
+                continue
+
+            # 情况2：注释符后面的内容
+            remaining_text = sql_text[comment_end:]
+
+            # 只有当后面全是空白字符时才删除注释符
+            if remaining_text.strip() == '':  # 后面只有空白字符，没有实际内容
+                sql_text = sql_text[:comment_pos]
+            # 如果后面有实际内容，保留注释符不做任何处理
+
+        return sql_text
+
+    if not isinstance(sql, str) or not isinstance(payload, str):
+        return None
+
+    try:
+        # 查找注入点
+        matches = list(re.finditer(r'\$\$', sql))
+        if not matches:
             return None
-        
+
+        positions = [match.start() for match in matches]
+
+        # 检查注入点后的字符类型
         try:
-            # 查找注入点
-            matches = list(re.finditer(r'\$\$', sql))
-            if not matches:
-                return None
-            
-            positions = [match.start() for match in matches]
-            
-            # 检查注入点后的字符类型
-            try:
-                potential_quote = sql[positions[0] + 2]
-                is_string_context = (potential_quote == "'")
-            except IndexError:
-                is_string_context = False
-            
-            # 根据上下文决定是否需要移除payload的第一个字符
-            if is_string_context:
-                injection_sql = sql.replace("$$", payload)
+            potential_quote = sql[positions[0] + 2]
+            is_string_context = (potential_quote == "'")
+        except IndexError:
+            is_string_context = False
+
+        # 根据上下文决定是否需要移除payload的第一个字符
+        if is_string_context:
+            injection_sql = sql.replace("$$", payload)
+        else:
+            new_payload = remove_first_char(payload)
+            injection_sql = sql.replace("$$", new_payload)
+
+        # 新增：去掉不必要的注释符
+        injection_sql = remove_unnecessary_comments(injection_sql)
+
+        # 检查符号平衡（只检查注释符之前的部分）
+        checker = SymbolChecker()
+        effective_sql = injection_sql.split('--')[0] if '--' in injection_sql else injection_sql
+        result, message = checker.check_balanced(effective_sql)
+
+        # 如果不平衡，尝试添加闭合括号
+        if not result:
+            comment_matches = list(re.finditer(r'--', injection_sql))
+            if comment_matches:
+                bracket_pos = comment_matches[0].start()
             else:
-                new_payload = remove_first_char(payload)
-                injection_sql = sql.replace("$$", new_payload)
-            
-            # 新增：去掉不必要的注释符
+                bracket_pos = len(injection_sql)
+
+            injection_sql = insert_char_at_position(injection_sql, bracket_pos, ')')
+
+            # 再次去掉可能产生的不必要注释符
             injection_sql = remove_unnecessary_comments(injection_sql)
-            
-            # 检查符号平衡（只检查注释符之前的部分）
-            checker = SymbolChecker()
-            effective_sql = injection_sql.split('--')[0] if '--' in injection_sql else injection_sql
-            result, message = checker.check_balanced(effective_sql)
-            
-            # 如果不平衡，尝试添加闭合括号
-            if not result:
-                comment_matches = list(re.finditer(r'--', injection_sql))
-                if comment_matches:
-                    bracket_pos = comment_matches[0].start()
-                else:
-                    bracket_pos = len(injection_sql)
-                
-                injection_sql = insert_char_at_position(injection_sql, bracket_pos, ')')
-                
-                # 再次去掉可能产生的不必要注释符
-                injection_sql = remove_unnecessary_comments(injection_sql)
-            
-            return injection_sql
-            
-        except Exception as e:
-            print(f"插入payload时出错: {e}")
-            return None
 
-    comment_flag = False
-    mysql_config['database'] = sql_example['db']
-    injection_sql_example = None
-    
+        return injection_sql
+
+    except Exception as e:
+        print(f"插入payload时出错: {e}")
+        return None
+
+def fill_stage(job, context):
+    """选择填充器并完成不访问数据库的部分（选表、选列、选系统信息）"""
+    payload_template = job.payload_template
     if payload_template['expected_types'] == None:
-        raw_payload = payload_template['payload']
-    else:
-        if payload_template['information_features'] == "system information":
-            if "table" in payload_template['expected_types']:
-                sys_schema = random.choice(sys_schemas)
-                filler_for_specific_databse = SpecificDatabaseTemplateFiller(sys_schema, mysql_config)
-                raw_payload = filler_for_specific_databse.fill_template(payload_template)
-            else:
-                filler_for_system_information = SystemInformationTemplateFiller(system_vars, mysql_config)
-                raw_payload = filler_for_system_information.fill_template(payload_template)
-        
-        if payload_template['information_features'] == "specific database":
-            schema = next((s for s in db_schemas if s['database_name'] == sql_example['db']), {})
-            filler_for_specific_databse = SpecificDatabaseTemplateFiller(schema, mysql_config)
-            raw_payload = filler_for_specific_databse.fill_template(payload_template)
+        job.raw_payload = payload_template['payload']
+        return
+    
+    # 每个任务使用自己的连接配置，避免并发时互相覆盖数据库名
+    job_config = dict(mysql_config, database=job.sql_example['db'])
+    if payload_template['information_features'] == "system information":
+        if "table" in payload_template['expected_types']:
+            candidate_schemas = context.feasibility.feasible_system_schemas(payload_template, context.sys_schemas) if context.feasibility else context.sys_schemas
+            sys_schema = job.rng.choice(candidate_schemas or context.sys_schemas)
+            job.filler = SpecificDatabaseTemplateFiller.for_schema(sys_schema, job_config, sample_store, sample_backend)
+        else:
+            job.filler = SystemInformationTemplateFiller.for_database(context.system_vars, job_config, sample_store, sample_backend)
     
-    if random.random() < comment_rate:
-        payload = str(raw_payload) + str(generate_comment(payload_template['type'], payload_template['payload'], raw_payload, comment_list))
-        comment_flag = True
+    # 带常量占位符（$int$ 等）的 constant 模板也由 SpecificDatabaseTemplateFiller 替换，不会访问数据库
+    if payload_template['information_features'] in ("specific database", "constant"):
+        schema = next((s for s in context.db_schemas if s['database_name'] == job.sql_example['db']), {})
+        job.filler = SpecificDatabaseTemplateFiller.for_schema(schema, job_config, sample_store, sample_backend)
+    
+    if job.filler is not None:
+        job.plan = job.filler.prepare(payload_template, verbose=context.verbose, rng=job.rng)
+
+def sample_stage(job, context):
+    """读取样本并完成模板替换"""
+    if job.plan is None:
+        return
+    try:
+        job.filler.fetch_samples(job.plan)
+    except DatabaseUnavailableError as e:
+        # 数据库不可用时跳过该样本，而不是用 NULL 生成坏样本
+        if context.verbose:
+            print(f"  ⚠️  跳过样本: {e}")
+        run_stats.increment('skipped_examples')
+        job.skipped = True
+        return
+    job.raw_payload = job.filler.render(job.plan)
+
+def comment_stage(job, context):
+    """按 comment_rate 为载荷追加注释"""
+    payload_template = job.payload_template
+    if job.rng.random() < context.comment_rate:
+        job.payload = str(job.raw_payload) + str(generate_comment(payload_template['type'], payload_template['payload'], job.raw_payload, comment_list, job.rng))
+        job.comment = True
     else:
-        payload = str(raw_payload)
-        comment_flag = False
-        
-    if sql_example['sql'] == None or payload == None:
-        return injection_sql_example
+        job.payload = str(job.raw_payload)
+        job.comment = False
+
+def splice_stage(job, context):
+    """把载荷插入SQL注入点并检查符号平衡"""
+    sql_example = job.sql_example
+    if sql_example['sql'] == None or job.payload == None:
+        return
     
-    injection_sql = insert_payload(sql_example['sql'], payload)
+    injection_sql = insert_payload(sql_example['sql'], job.payload)
+    if injection_sql is None:
+        return
     effective_sql = injection_sql.split('--')[0]
     result, message = checker.check_balanced(effective_sql)
 
     if not result:
-        print(f"'{effective_sql}'\n  -> {result}: {message}\n")
+        run_stats.increment('unbalanced_sqls')
+        if context.verbose:
+            print(f"'{effective_sql}'\n  -> {result}: {message}\n")
     else:
-        injection_sql_example = {
-            "sql": injection_sql,
-            "original_sql": sql_example,
-            "payload_template":payload_template,
-            "payload":payload,
-            "label":False,
-            "comment":comment_flag,
-            "difficulty": identify_difficulty(sql_example['annotator'], comment_flag, payload_template['information_features'])
-        }
-    return injection_sql_example
+        job.result = InjectionExample(
+            sql=injection_sql,
+            original_sql_id=job.sql_id,
+            payload_template_id=job.payload_id,
+            payload=job.payload,
+            label=False,
+            comment=job.comment,
+            difficulty=identify_difficulty(sql_example['annotator'], job.comment, job.payload_template['information_features']),
+            sample_fallback=job.plan is not None and job.plan.fallback_count > 0
+        )
+
+def validate_batch(jobs, context):
+    """
+    用 SQL 解析器或 EXPLAIN 批量校验一批样本生成的 SQL（未配置 validator 时跳过），不合法的丢弃
+    
+    校验本身失败（如数据库不可用）时整批按出错处理，与单个阶段出错一致（见 run_stage）。
+    """
+    checked = [job for job in jobs if job.result is not None]
+    if context.validator is None or not checked:
+        return
+    try:
+        errors = context.validator.validate_many([job.result.sql for job in checked], [job.sql_example['db'] for job in checked])
+    except Exception as e:
+        run_stats.increment('stage_errors')
+        if context.verbose:
+            print(f"  ⚠️  阶段 validate 出错: {e}")
+        for job in checked:
+            job.result = None
+            job.skipped = True
+            job.error = e
+        return
+    for job, error in zip(checked, errors):
+        if error is not None:
+            run_stats.increment('invalid_sqls')
+            if context.verbose:
+                print(f"'{job.result.sql}'\n  -> 语法错误: {error}\n")
+            job.result = None
+
+# 生成流程的各阶段：选择组合 → 填充模板 → 读取样本 → 生成注释 → 拼接/校验 → 输出
+# 语法校验需要成批进行，不是逐个样本的阶段，而是在输出前按批执行（见 generate_injection_sqls）
+PIPELINE_STAGES = [
+    ("fill", fill_stage),
+    ("sample", sample_stage),
+    ("comment", comment_stage),
+    ("splice", splice_stage)
+]
+
+def run_job(job, context):
+    """
+    按顺序执行所有阶段，出错的样本标记为跳过（见 run_stage）
+    
+    Raises:
+        LLMBudgetExceededError: LLM 预算耗尽
+    """
+    for name, stage in PIPELINE_STAGES:
+        if job.skipped:
+            break
+        run_stage(name, stage, job, context)
+
+def pipeline(sql_example, payload_template, db_schemas, sys_schemas, system_vars, comment_rate, sql_id=None, payload_id=None, feasibility=None):
+    """
+    为一个 (SQL, 载荷) 组合生成一个样本
+    
+    传入 sql_id 和 payload_id 时返回按下标引用语料的 InjectionExample；
+    不传时与原来一样返回展开后的样本字典。生成失败时返回 None。
+    """
+    standalone = sql_id is None or payload_id is None
+    if standalone:
+        sql_id, payload_id = 0, 0
+    job = GenerationJob(None, sql_id, payload_id, sql_example, payload_template)
+    run_job(job, GenerationContext(db_schemas, sys_schemas, system_vars, comment_rate, feasibility))
+    if standalone and job.result is not None:
+        return job.result.to_dict([sql_example], [payload_template])
+    return job.result
+
+def shard_range(expected_exmaple_num, shard_index, shard_count):
+    """计算分片负责的样本下标区间 [start, end)，各分片互不重叠且覆盖全部下标"""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard_index 必须在 [0, {shard_count}) 内")
+    start = expected_exmaple_num * shard_index // shard_count
+    end = expected_exmaple_num * (shard_index + 1) // shard_count
+    return start, end
+
+def select_jobs(expected_exmaple_num, raw_sqls, payloads, shard_index=0, shard_count=1, seed=None, feasibility=None):
+    """
+    依次为分片中的每个样本下标选择 (SQL, 载荷) 组合，生成 GenerationJob
+    
+    指定 seed 时每个样本下标使用独立的确定性随机数生成器（job.rng），同一下标在任何机器上选出相同的组合，
+    之后各阶段的随机选择也使用它，与执行顺序和线程数无关；不指定时使用全局 random。
+    指定 feasibility 时只为 SQL 所在数据库抽取可满足的载荷模板，没有可选载荷的下标直接标记为跳过。
+    """
+    start, end = shard_range(expected_exmaple_num, shard_index, shard_count)
+    
+    feasible_payload_ids = None
+    if feasibility is not None:
+        # 语料可能是按需读取的 LazyJsonArray，各遍历一次
+        databases = {sql_example['db'] for sql_example in raw_sqls}
+        feasible_payload_ids = {db: [] for db in databases}
+        for i, payload_template in enumerate(payloads):
+            for db in databases:
+                if feasibility.is_feasible(payload_template, db):
+                    feasible_payload_ids[db].append(i)
+    
+    for example_index in range(start, end):
+        rng = random.Random(f"{seed}:{example_index}") if seed is not None else random
+        sql_id = rng.randrange(len(raw_sqls))
+        if feasible_payload_ids is None:
+            payload_id = rng.randrange(len(payloads))
+        elif feasible_payload_ids[raw_sqls[sql_id]['db']]:
+            payload_id = rng.choice(feasible_payload_ids[raw_sqls[sql_id]['db']])
+        else:
+            run_stats.increment('infeasible_sqls')
+            yield GenerationJob(example_index, sql_id, None, raw_sqls[sql_id], None, skipped=True, rng=rng)
+            continue
+        yield GenerationJob(example_index, sql_id, payload_id, raw_sqls[sql_id], payloads[payload_id], rng=rng)
 
-def batch_generate_injection_sqls(expected_exmaple_num, raw_sqls, payloads, db_schemas, sys_schemas, system_vars, comment_rate):
-    count = 0
+def generate_injection_sqls(expected_exmaple_num, raw_sqls, payloads, db_schemas, sys_schemas, system_vars, comment_rate, on_job,
+                            shard_index=0, shard_count=1, seed=None, feasibility=None, stage_workers=None, queue_size=64,
+                            validator=None, progress=None, validate_batch_size=64):
+    """
+    流式生成注入样本：每处理完一个样本立即调用 on_job(job)，不保留任何结果
+    
+    顺序执行时按样本下标顺序回调，分阶段流水线执行时按完成顺序回调（下标见 job.example_index）。
+    指定 validator 时完成的样本先攒够 validate_batch_size 个再一起校验、回调（见 validate_batch）。
+    内存占用只与在途样本数（队列容量和校验批大小）有关，与目标样本数无关。
+    达到 LLM 预算时停止，未完成的样本不回调。其余参数见 batch_generate_injection_sqls。
+    """
+    context = GenerationContext(db_schemas, sys_schemas, system_vars, comment_rate, feasibility, validator, verbose=progress is None)
+    jobs = select_jobs(expected_exmaple_num, raw_sqls, payloads, shard_index, shard_count, seed, feasibility)
+    batch = []
+    
+    def _flush():
+        finished = batch[:]
+        batch.clear()
+        validate_batch(finished, context)
+        for job in finished:
+            if progress is not None:
+                progress.record(job)
+            on_job(job)
+    
+    def _finish(job):
+        batch.append(job)
+        if validator is None or len(batch) >= validate_batch_size:
+            _flush()
+    
+    try:
+        if stage_workers is None:
+            for job in jobs:
+                try:
+                    run_job(job, context)
+                except LLMBudgetExceededError as e:
+                    print(f"⚠️  停止生成: {e}")
+                    break
+                _finish(job)
+        else:
+            stages = [(name, stage, stage_workers.get(name, 1)) for name, stage in PIPELINE_STAGES]
+            StagedPipeline(stages, context, queue_size).run(jobs, _finish)
+    finally:
+        # 出错时也把已完成的样本交出去
+        _flush()
+
+def batch_generate_injection_sqls(expected_exmaple_num, raw_sqls, payloads, db_schemas, sys_schemas, system_vars, comment_rate,
+                                  shard_index=0, shard_count=1, seed=None, feasibility=None, stage_workers=None, queue_size=64,
+                                  validator=None, progress=None):
+    """
+    批量生成注入样本
+    
+    指定 shard_count > 1 时只生成第 shard_index 个分片负责的样本下标（见 select_jobs）。
+    指定 stage_workers（如 {"sample": 4, "comment": 8}）时使用分阶段流水线并发执行，
+    否则逐个样本顺序执行。指定 seed 时每个下标的组合和各阶段的随机选择（表、列、注释）
+    都可复现，与是否并发执行无关；样本取值取决于读取时蓄水池中的内容。
+    指定 validator（SQLValidator）时丢弃语法不合法的结果。
+    指定 progress（ProgressReporter）时定期汇报进度，不再逐条打印被拒绝的样本。
+    目标样本数很大时使用 generate_injection_sqls 直接写出，不在内存中保留结果。
+    
+    Returns:
+        按样本下标排列的结果（失败为 None）；达到 LLM 预算提前停止时只包含已完成的前缀
+    """
+    results = {}
+    generate_injection_sqls(expected_exmaple_num, raw_sqls, payloads, db_schemas, sys_schemas, system_vars, comment_rate,
+                            lambda job: results.__setitem__(job.example_index, job.result),
+                            shard_index, shard_count, seed, feasibility, stage_workers, queue_size, validator, progress)
+    
     injection_sql_examples = []
-    while count < expected_exmaple_num:
-        injection_sql_example = pipeline(random.choice(raw_sqls), random.choice(payloads), db_schemas, sys_schemas, system_vars, comment_rate)
-        injection_sql_examples.append(injection_sql_example)
-        count += 1
+    start, end = shard_range(expected_exmaple_num, shard_index, shard_count)
+    for example_index in range(start, end):
+        if example_index not in results:
+            break
+        injection_sql_examples.append(results[example_index])
     return injection_sql_examples
 
+def shard_file_name(shard_index, shard_count):
+    return f"shard-{shard_index:05d}-of-{shard_count:05d}.jsonl"
+
+def write_shard_records(path, expected_exmaple_num, shard_index, shard_count, raw_sqls, payloads, db_schemas, sys_schemas, system_vars, comment_rate,
+                        seed=0, feasibility=None, stage_workers=None, validator=None, progress=None, parquet_dir=None, part_name="part-0"):
+    """
+    生成第 shard_index / shard_count 个下标区间，每个样本完成后立即写成 path 中的一行记录
+    
+    指定 parquet_dir 时同时把生成成功的样本写入该 Parquet 数据集，文件名为 part_name。
+    """
+    parquet_writer = ParquetExampleWriter(parquet_dir, raw_sqls, payloads, part_name=part_name) if parquet_dir is not None else None
+    with open(path, 'w', encoding='utf-8') as f:
+        def _write(job):
+            record = {
+                "example_index": job.example_index,
+                "expected_example_num": expected_exmaple_num,
+                "example": job.result.to_dict(raw_sqls, payloads) if job.result else None
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if parquet_writer is not None and job.result:
+                parquet_writer.write(job.result)
+        
+        try:
+            generate_injection_sqls(expected_exmaple_num, raw_sqls, payloads, db_schemas, sys_schemas, system_vars, comment_rate, _write,
+                                    shard_index, shard_count, seed, feasibility, stage_workers, validator=validator, progress=progress)
+        finally:
+            if parquet_writer is not None:
+                parquet_writer.close()
+
+def run_shard(expected_exmaple_num, shard_index, shard_count, output_dir, raw_sqls, payloads, db_schemas, sys_schemas, system_vars, comment_rate, seed=0, feasibility=None, stage_workers=None, validator=None,
+              progress=None, parquet_dir=None, processes=1):
+    """
+    生成一个分片并写出 JSONL 文件
+    
+    每行记录一个样本下标，生成失败的下标记录为 example: null，便于合并时检查完整性。
+    样本完成后立即写出（流水线执行时按完成顺序），内存占用与分片大小无关。
+    先写临时文件、完成后再改名，未跑完的分片不会被当作完整分片。
+    指定 parquet_dir 时同时把生成成功的样本写入该 Parquet 数据集（文件名为分片名）。
+    processes > 1 时把分片再按下标区间分给多个工作进程生成，样本取值池通过共享样本库
+    只保存一份（见 generate_shard_parts），validator 只用来确定校验方式。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    shard_name = shard_file_name(shard_index, shard_count)
+    output_path = os.path.join(output_dir, shard_name)
+    if parquet_dir is not None:
+        # 上次运行的进程数可能不同，先删除该分片以任何方式写出的旧文件
+        stem = glob.escape(shard_name.removesuffix(".jsonl"))
+        ParquetExampleWriter.remove_parts(parquet_dir, stem)
+        ParquetExampleWriter.remove_parts(parquet_dir, f"{stem}-part-*")
+    if processes <= 1:
+        write_shard_records(output_path + ".tmp", expected_exmaple_num, shard_index, shard_count, raw_sqls, payloads, db_schemas, sys_schemas, system_vars,
+                            comment_rate, seed, feasibility, stage_workers, validator, progress, parquet_dir, shard_name.removesuffix(".jsonl"))
+    else:
+        part_paths = generate_shard_parts(expected_exmaple_num, shard_index, shard_count, output_path, processes, raw_sqls, payloads,
+                                          db_schemas, sys_schemas, system_vars, comment_rate, seed, feasibility, stage_workers,
+                                          validator.mode if validator is not None else None, progress, parquet_dir)
+        with open(output_path + ".tmp", 'wb') as f:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, f)
+                os.remove(part_path)
+    os.replace(output_path + ".tmp", output_path)
+    return output_path
+
+def merge_shards(shard_dir, output_path, raw_sqls=None, payloads=None, parquet_dir=None):
+    """
+    合并分片文件并检查完整性和重复
+    
+    提供 raw_sqls 和 payloads 时同时写出输入清单（见 InputManifest），供增量生成使用。
+    指定 parquet_dir 时同时把合并后的样本导出为 Parquet 数据集（见 ParquetExampleWriter），文件名取输出文件名。
+    分片文件读两遍（先检查、再写出），不在内存中保留样本：下标按分片区间顺序检查，
+    SQL 哈希分桶写入临时文件后逐桶统计重复，内存占用与样本总数无关。
+    
+    Returns:
+        检查报告，complete 为 False 时不写出合并文件
+    """
+    shard_pattern = re.compile(r'shard-(\d+)-of-(\d+)\.jsonl$')
+    shard_files = {}
+    shard_counts = set()
+    for name in sorted(os.listdir(shard_dir)):
+        match = shard_pattern.match(name)
+        if match:
+            shard_files[int(match.group(1))] = os.path.join(shard_dir, name)
+            shard_counts.add(int(match.group(2)))
+    
+    report = {
+        "shard_count": None,
+        "missing_shards": [],
+        "missing_indices": 0,
+        "duplicate_indices": 0,
+        "out_of_range_indices": 0,
+        "duplicate_sqls": 0,
+        "rejected_examples": 0,
+        "merged_examples": 0,
+        "complete": False
+    }
+    if len(shard_counts) != 1:
+        print(f"分片数量不一致或没有分片文件: {sorted(shard_counts)}")
+        return report
+    shard_count = shard_counts.pop()
+    report["shard_count"] = shard_count
+    report["missing_shards"] = [i for i in range(shard_count) if i not in shard_files]
+    
+    # 各分片记录的样本总数应一致，先从第一条记录取出，用来计算各分片的下标区间
+    expected_exmaple_num = None
+    for shard_index in sorted(shard_files):
+        with open(shard_files[shard_index], encoding='utf-8') as f:
+            line = f.readline()
+        if line:
+            expected_exmaple_num = json.loads(line)["expected_example_num"]
+            break
+    if expected_exmaple_num is None:
+        print("分片文件中没有任何记录")
+        return report
+    
+    # 第一遍只做检查。分片内的记录只在在途样本范围内乱序，按下标顺序推进 next_index，
+    # 只需记住已到达但还不能推进的下标（ahead），不需要全局位图。
+    # SQL 的 64 位哈希按首字节分桶写入临时文件，之后逐桶统计重复，内存中只有一个桶
+    expected_nums = {expected_exmaple_num}
+    with tempfile.TemporaryDirectory() as hash_dir:
+        buckets = [open(os.path.join(hash_dir, f"{i:02x}"), 'wb') for i in range(256)]
+        try:
+            for shard_index in range(shard_count):
+                start, end = shard_range(expected_exmaple_num, shard_index, shard_count)
+                if shard_index not in shard_files:
+                    report["missing_indices"] += end - start
+                    continue
+                next_index = start
+                ahead = set()
+                out_of_range = 0
+                with open(shard_files[shard_index], encoding='utf-8') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        expected_nums.add(record["expected_example_num"])
+                        example_index = record["example_index"]
+                        if not start <= example_index < end:
+                            out_of_range += 1
+                            continue
+                        if example_index < next_index or example_index in ahead:
+                            report["duplicate_indices"] += 1
+                            continue
+                        ahead.add(example_index)
+                        while next_index in ahead:
+                            ahead.remove(next_index)
+                            next_index += 1
+                        if record["example"] is None:
+                            report["rejected_examples"] += 1
+                            continue
+                        digest = hashlib.blake2b(record["example"]["sql"].encode('utf-8'), digest_size=8).digest()
+                        buckets[digest[0]].write(digest)
+                report["missing_indices"] += (end - next_index) - len(ahead)
+                if out_of_range:
+                    print(f"分片 {shard_files[shard_index]} 中有 {out_of_range} 个样本下标不在该分片的区间 [{start}, {end}) 内")
+                    report["out_of_range_indices"] += out_of_range
+        finally:
+            for bucket in buckets:
+                bucket.close()
+        for bucket in buckets:
+            hashes = array('Q')
+            with open(bucket.name, 'rb') as f:
+                hashes.frombytes(f.read())
+            report["duplicate_sqls"] += len(hashes) - len(set(hashes))
+    
+    if len(expected_nums) != 1:
+        print(f"各分片的样本总数不一致: {sorted(expected_nums)}")
+        return report
+    report["complete"] = (not report["missing_shards"] and report["missing_indices"] == 0 and report["duplicate_indices"] == 0
+                          and report["out_of_range_indices"] == 0)
+    if not report["complete"]:
+        return report
+    
+    # 第二遍按分片顺序流式写出。每个分片覆盖连续的下标区间，分片内按完成顺序写出的记录
+    # 只在在途样本范围内乱序，用一个小的重排缓冲恢复下标顺序
+    part_name = os.path.splitext(os.path.basename(output_path))[0]
+    parquet_writer = ParquetExampleWriter(parquet_dir, part_name=part_name) if parquet_dir is not None else None
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for shard_index in range(shard_count):
+            start, end = shard_range(expected_exmaple_num, shard_index, shard_count)
+            next_index = start
+            pending = {}
+            with open(shard_files[shard_index], encoding='utf-8') as shard_file:
+                for line in shard_file:
+                    record = json.loads(line)
+                    pending[record["example_index"]] = record["example"]
+                    while next_index in pending:
+                        example = pending.pop(next_index)
+                        next_index += 1
+                        if example is not None:
+                            f.write(json.dumps(example, ensure_ascii=False) + "\n")
+                            if parquet_writer is not None:
+                                parquet_writer.write_record(example)
+                            report["merged_examples"] += 1
+            if pending or next_index != end:
+                raise ValueError(f"分片 {shard_files[shard_index]} 中的样本下标不在该分片的区间 [{start}, {end}) 内")
+    if parquet_writer is not None:
+        parquet_writer.close()
+    if raw_sqls is not None and payloads is not None:
+        InputManifest.build(raw_sqls, payloads, expected_exmaple_num).save(InputManifest.path_for(output_path))
+    return report
+
+def incremental_update(output_path, raw_sqls, payloads, db_schemas, sys_schemas, system_vars, comment_rate,
+                       seed=0, feasibility=None, stage_workers=None, validator=None, progress_interval=10.0):
+    """
+    输入变化后增量更新已合并的输出文件
+    
+    - 输入已被删除或修改的样本直接丢弃（按样本中内嵌的 original_sql / payload_template 的内容哈希判断）
+    - 只为新增或修改的 SQL、载荷模板生成样本，数量按清单中每条记录的平均样本数计算
+    - 其余样本原样保留，最后写回输出文件并更新清单
+    
+    生成进度写入 <输出文件>.status.json。
+    
+    Returns:
+        更新报告
+    """
+    with open(output_path, encoding='utf-8') as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+    manifest_path = InputManifest.path_for(output_path)
+    manifest = InputManifest.load(manifest_path) if os.path.exists(manifest_path) else InputManifest.from_examples(examples)
+    
+    current = InputManifest.build(raw_sqls, payloads, 0)
+    kept_examples = [
+        example for example in examples
+        if record_key(example['original_sql']) in current.sqls and record_key(example['payload_template']) in current.payloads
+    ]
+    new_sqls = [sql_example for sql_example in raw_sqls if record_key(sql_example) not in manifest.sqls]
+    new_payloads = [payload_template for payload_template in payloads if record_key(payload_template) not in manifest.payloads]
+    
+    new_examples = []
+    # 新 SQL 与全部载荷组合，新载荷与全部 SQL 组合（两边都是新记录的组合可能出现在任意一边）
+    targets = [
+        (new_sqls, payloads, round(manifest.examples_per_sql * len(new_sqls))),
+        (raw_sqls, new_payloads, round(manifest.examples_per_payload * len(new_payloads)))
+    ]
+    targets = [(candidate_sqls, candidate_payloads, target) for candidate_sqls, candidate_payloads, target in targets
+               if target > 0 and candidate_sqls and candidate_payloads]
+    progress = ProgressReporter(sum(target for _, _, target in targets), progress_interval, output_path + ".status.json")
+    for candidate_sqls, candidate_payloads, target in targets:
+        generated = batch_generate_injection_sqls(target, candidate_sqls, candidate_payloads, db_schemas, sys_schemas, system_vars, comment_rate,
+                                                  seed=seed, feasibility=feasibility, stage_workers=stage_workers, validator=validator,
+                                                  progress=progress)
+        new_examples.extend(example.to_dict(candidate_sqls, candidate_payloads) for example in generated if example)
+    progress.finish()
+    
+    with open(output_path + ".tmp", 'w', encoding='utf-8') as f:
+        for example in kept_examples + new_examples:
+            f.write(json.dumps(example, ensure_ascii=False) + "\n")
+    os.replace(output_path + ".tmp", output_path)
+    
+    current.examples_per_sql = manifest.examples_per_sql
+    current.examples_per_payload = manifest.examples_per_payload
+    current.save(manifest_path)
+    return {
+        "new_sqls": len(new_sqls),
+        "new_payloads": len(new_payloads),
+        "removed_sqls": len(manifest.sqls - current.sqls),
+        "removed_payloads": len(manifest.payloads - current.payloads),
+        "kept_examples": len(kept_examples),
+        "dropped_examples": len(examples) - len(kept_examples),
+        "generated_examples": len(new_examples)
+    }
 
-# 生成测试集注入样本
-test_injection_sqls = batch_generate_injection_sqls(30, test_raw_sqls, test_payloads, db_schemas, sys_schemas, system_vars, comment_rate=0.3)
+def publish_sample_store(db_schemas, sys_schemas, system_vars, mysql_config, backend=None) -> SharedSampleStore:
+    """
+    读取所有表的列取值池和所有系统变量的取值，发布为共享样本库
+    
+    使用临时的蓄水池读取，不注册为各数据库共用的蓄水池（ReservoirSampler.for_database），
+    之后 fork 出的工作进程不会继承一份样本副本。
+    每个表单独读取，读取失败的表或变量不写入样本库，工作进程会对它们回退为直接查询样本后端。
+    系统变量在每个业务数据库中各查询一次，与 SystemInformationTemplateFiller 使用样本自己的数据库一致。
+    """
+    if backend is None:
+        backend = sample_backend or PyMySQLBackend.for_config(mysql_config)
+    pools = {}
+    for schema in list(db_schemas) + list(sys_schemas):
+        db_name = schema.get('database_name', 'unknown')
+        sampler = ReservoirSampler(db_name, backend)
+        for table in schema.get('tables', []):
+            columns = [col['column_name'] for col in table.get('columns', [])]
+            if not columns:
+                continue
+            try:
+                sampler.ensure({table['table_name']: columns})
+            except DatabaseUnavailableError as e:
+                print(f"  ⚠️  警告: 数据库 {db_name} 不可用，跳过其余的表 ({e})")
+                break
+            except Exception as e:
+                print(f"  ⚠️  警告: 读取表 {db_name}.{table['table_name']} 失败 ({e})")
+                continue
+            for col, values in sampler.pools(table['table_name'], columns).items():
+                pools[SharedSampleStore.column_key(db_name, table['table_name'], col)] = values
+    
+    for schema in db_schemas:
+        db_name = schema.get('database_name', 'unknown')
+        for info in system_vars:
+            try:
+                value = backend.system_value(db_name, info['variable'])
+            except DatabaseUnavailableError as e:
+                print(f"  ⚠️  警告: 数据库 {db_name} 不可用，跳过其余的系统信息 ({e})")
+                break
+            except Exception as e:
+                print(f"查询系统信息失败 [{db_name}: {info['variable']}]: {e}")
+                continue
+            if value is not None and str(value):
+                pools[SharedSampleStore.sysinfo_key(db_name, info['variable'])] = [str(value)]
+    
+    return SharedSampleStore.publish(pools)
 
-for sql_example in test_injection_sqls:
-    print(sql_example)
-    print("-------------------------------------------------------------------------------------")
+class _ProgressForwarder:
+    """
+    工作进程中的进度记录器：把完成的样本连同运行统计、LLM 用量的增量交给主进程
+    
+    增量从创建时开始计算，fork 时从主进程继承的计数不会被重复累加。
+    """
+    
+    def __init__(self, finished_queue):
+        self.finished_queue = finished_queue
+        self.count = 0
+        self._stats = run_stats.snapshot()
+        self._usage = llm_client.usage()
+    
+    def deltas(self):
+        """返回上次调用以来本进程新增的 (运行统计, LLM 用量)"""
+        stats, usage = run_stats.snapshot(), llm_client.usage()
+        stats_delta = {name: count - self._stats.get(name, 0) for name, count in stats.items() if count != self._stats.get(name, 0)}
+        usage_delta = {name: amount - self._usage.get(name, 0) for name, amount in usage.items() if amount != self._usage.get(name, 0)}
+        self._stats, self._usage = stats, usage
+        return stats_delta, usage_delta
+    
+    def record(self, job):
+        self.finished_queue.put((job.result, job.skipped, *self.deltas()))
+        self.count += 1
+
+_finished_queue = None  # 多进程生成分片时工作进程向主进程汇报进度的队列
+
+def attach_sample_store(name):
+    """挂载共享样本库"""
+    global sample_store
+    sample_store = SharedSampleStore.attach(name)
+
+def init_shard_worker(store_name, finished_queue, processes):
+    """
+    分片工作进程初始化函数：挂载共享样本库，并换用配额为 1/processes 的 LLM 客户端
+    
+    各工作进程各有一个 LLM 客户端，均分配额后合计的请求速率和花费不超过主进程的设置。
+    """
+    global llm_client, _finished_queue
+    attach_sample_store(store_name)
+    _finished_queue = finished_queue
+    llm_client = llm_client.split(processes)
+
+def _generate_shard_part(part_path, expected_exmaple_num, part_index, part_count, raw_sqls, payloads, db_schemas, sys_schemas, system_vars,
+                         comment_rate, seed, feasibility, stage_workers, validate_mode, parquet_dir, part_name):
+    """工作进程：生成分片中的一段下标区间，返回 (写出的样本数, 运行统计增量, LLM 用量增量)"""
+    # 工作进程本身不能再创建进程池，parser 校验在当前进程中进行
+    validator = SQLValidator(validate_mode, workers=0, backend=sample_backend) if validate_mode else None
+    progress = _ProgressForwarder(_finished_queue)
+    try:
+        write_shard_records(part_path, expected_exmaple_num, part_index, part_count, raw_sqls, payloads, db_schemas, sys_schemas, system_vars,
+                            comment_rate, seed, feasibility, stage_workers, validator, progress, parquet_dir, part_name)
+    finally:
+        if validator is not None:
+            validator.close()
+    return (progress.count, *progress.deltas())
+
+def generate_shard_parts(expected_exmaple_num, shard_index, shard_count, output_path, processes, raw_sqls, payloads, db_schemas, sys_schemas, system_vars,
+                         comment_rate, seed=0, feasibility=None, stage_workers=None, validate_mode=None, progress=None, parquet_dir=None):
+    """
+    用 processes 个工作进程生成一个分片，样本取值池只在共享内存中保存一份
+    
+    分片 k 的第 i 段就是把总数分成 shard_count * processes 份时的第 k * processes + i 份，
+    各段首尾相接、恰好覆盖分片 k 的下标区间，与单进程生成时每个下标选出的组合相同。
+    
+    Returns:
+        按下标顺序排列的各段记录文件（<output_path>.part-<i>），由调用方合并
+    """
+    part_count = shard_count * processes
+    part_paths = [f"{output_path}.part-{i}" for i in range(processes)]
+    shard_name = os.path.basename(output_path).removesuffix(".jsonl")
+    tasks = [
+        (part_paths[i], expected_exmaple_num, shard_index * processes + i, part_count, raw_sqls, payloads, db_schemas, sys_schemas, system_vars,
+         comment_rate, seed, feasibility, stage_workers, validate_mode, parquet_dir, f"{shard_name}-part-{i}")
+        for i in range(processes)
+    ]
+    
+    store = publish_sample_store(db_schemas, sys_schemas, system_vars, mysql_config)
+    finished_queue = multiprocessing.Queue()
+    
+    def _merge(stats_delta, usage_delta):
+        run_stats.merge(stats_delta)
+        llm_client.add_usage(usage_delta)
+    
+    def _drain(block):
+        try:
+            result, skipped, stats_delta, usage_delta = finished_queue.get(timeout=0.5) if block else finished_queue.get_nowait()
+        except Empty:
+            return 0
+        _merge(stats_delta, usage_delta)
+        if progress is not None:
+            progress.record(GenerationJob(None, 0, None, None, None, result=result, skipped=skipped))
+        return 1
+    
+    try:
+        with Pool(processes, initializer=init_shard_worker, initargs=(store.name, finished_queue, processes)) as pool:
+            pending = pool.starmap_async(_generate_shard_part, tasks)
+            received = 0
+            while not pending.ready():
+                received += _drain(block=True)
+            expected = 0
+            for count, stats_delta, usage_delta in pending.get():
+                expected += count
+                _merge(stats_delta, usage_delta)
+            # 工作进程的队列由后台线程发送，任务结束后可能还有记录在途
+            while received < expected:
+                received += _drain(block=True)
+    finally:
+        store.close()
+    return part_paths
+
+
+KNOWN_PLACEHOLDER_PATTERN = re.compile(r'(table_\d+|column_t\d+_\d+|sample_t\d+_\d+|int|float|hex|time|date|character|sysInfo|sample)$')
+
+def analyze_payload_templates(payloads, db_schemas, sys_schemas, system_vars, mysql_config):
+    """
+    离线检查所有载荷模板，并计算模板 × 数据库的可满足性矩阵
+    
+    检查项：占位符是否符合语法、expected_types 长度是否与占位符数量一致、
+    类型约束是否合法，以及每个数据库（系统库）中是否存在能满足约束的表。
+    
+    Returns:
+        (问题列表, FeasibilityMatrix)
+    """
+    db_fillers = [SpecificDatabaseTemplateFiller(schema, mysql_config, backend=sample_backend) for schema in db_schemas]
+    sys_fillers = [SpecificDatabaseTemplateFiller(schema, mysql_config, backend=sample_backend) for schema in sys_schemas]
+    sysinfo_filler = SystemInformationTemplateFiller(system_vars, mysql_config, backend=sample_backend)
+    all_databases = [filler.db_name for filler in db_fillers]
+    constant_types = {marker: type_name for marker, (type_name, _) in SpecificDatabaseTemplateFiller.CONSTANT_PLACEHOLDERS.items()}
+    
+    issues = []
+    matrix = {}
+    for index, payload_template in enumerate(payloads):
+        payload = payload_template.get('payload') or ''
+        expected_types = payload_template.get('expected_types')
+        information_features = payload_template.get('information_features')
+        
+        def report(severity, message):
+            issues.append({"index": index, "payload": payload, "severity": severity, "message": message})
+        
+        tokens = re.findall(r'\$(\w+)\$', payload)
+        for token in tokens:
+            if not KNOWN_PLACEHOLDER_PATTERN.match(token):
+                report("error", f"未知占位符 ${token}$")
+        
+        feasible_databases = all_databases
+        feasible_system_schemas = []
+        
+        if expected_types is None:
+            if tokens:
+                report("error", f"未提供 expected_types，占位符不会被替换: {tokens}")
+        
+        elif information_features == "specific database" or (
+                information_features == "system information" and "table" in expected_types):
+            fillers = db_fillers if information_features == "specific database" else sys_fillers
+            if not fillers:
+                report("error", "没有可用于填充的数据库模式")
+                feasible_databases = []
+            else:
+                # 与 fill_template 相同：先去掉常量占位符及其类型，再分配类型约束
+                present_types = {type_name for marker, type_name in constant_types.items() if marker in payload}
+                remaining_types = [item for item in expected_types if item not in present_types]
+                placeholders = [p for p in fillers[0]._parse_marked_template(payload) if p.full_match not in constant_types]
+                if not fillers[0]._bind_expected_types(placeholders, remaining_types):
+                    report("warning", f"expected_types 长度 ({len(remaining_types)}) 与占位符数量 ({len(placeholders)}) 不匹配")
+                for placeholder in placeholders:
+                    if placeholder.type in ('column', 'sample') and placeholder.expected_type not in SpecificDatabaseTemplateFiller.TYPE_MAPPING \
+                            and placeholder.expected_type != 'table':
+                        report("error", f"{placeholder.full_match} 的类型约束 {placeholder.expected_type} 无法识别")
+                
+                problems = {filler.db_name: filler.find_unsatisfiable_tables(placeholders) for filler in fillers}
+                feasible = [db_name for db_name, db_problems in problems.items() if not db_problems]
+                if information_features == "specific database":
+                    feasible_databases = feasible
+                else:
+                    feasible_system_schemas = feasible
+                    feasible_databases = all_databases if feasible else []
+                if not feasible:
+                    report("error", f"没有任何数据库能满足类型约束，例如: {next(iter(problems.values()))}")
+                elif len(feasible) < len(fillers):
+                    report("info", f"{len(fillers) - len(feasible)}/{len(fillers)} 个数据库无法满足类型约束")
+        
+        elif information_features == "system information":
+            sysinfo_count = payload.count('$sysInfo$')
+            if sysinfo_count == 0:
+                report("warning", "没有 $sysInfo$ 占位符")
+            for i in range(sysinfo_count):
+                expected_type = expected_types[i] if i < len(expected_types) else 'all'
+                if not sysinfo_filler.sysinfo_by_type.get(expected_type):
+                    report("warning", f"没有类型为 {expected_type} 的系统变量，将使用默认值")
+        
+        elif information_features != "constant":
+            report("error", f"未知的 information_features: {information_features}")
+        
+        matrix[record_key(payload_template)] = {
+            "databases": feasible_databases,
+            "system_schemas": feasible_system_schemas
+        }
+    
+    return issues, FeasibilityMatrix({"payloads": matrix})
+
+def measure_peak_memory(targets, backend="pymysql", seed_rows=None, split="train", comment_rate=0.0, seed=0):
+    """
+    对每个目标样本数在子进程中生成一个完整分片，记录子进程的峰值 RSS
+    
+    子进程按需读取语料（INJECTION_SQL_LAZY_CORPORA=1），样本写到临时目录后丢弃。
+    流式生成时各目标的峰值内存应基本相同。
+    
+    Returns:
+        [{"target": 样本数, "peak_rss_mb": 峰值 RSS, "seconds": 耗时}, ...]
+    """
+    env = dict(os.environ, INJECTION_SQL_LAZY_CORPORA="1")
+    results = []
+    for target in targets:
+        with tempfile.TemporaryDirectory() as output_dir:
+            command = [sys.executable, os.path.abspath(__file__), "--backend", backend]
+            if seed_rows:
+                command += ["--seed-rows", seed_rows]
+            command += ["shard", "--shard-index", "0", "--shard-count", "1", "--num-examples", str(target),
+                        "--set", split, "--comment-rate", str(comment_rate), "--seed", str(seed),
+                        "--output-dir", output_dir, "--progress-interval", "1e9"]
+            started = monotonic()
+            child = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+            _, status, usage = os.wait4(child.pid, 0)
+            exit_code = os.waitstatus_to_exitcode(status)
+            if exit_code != 0:
+                raise RuntimeError(f"目标 {target} 的生成子进程退出码为 {exit_code}")
+            # Linux 上 ru_maxrss 单位为 KB
+            results.append({"target": target, "peak_rss_mb": round(usage.ru_maxrss / 1024, 1), "seconds": round(monotonic() - started, 1)})
+    return results
+
+def create_sample_backend(name, mysql_config, seed_path=None):
+    """
+    按名称创建样本后端
+    
+    - pymysql: 连接 mysql_config 指定的 MySQL 服务器
+    - sqlite: 内存 SQLite，按 schema.json / system_table_schema.json 建表并写入种子数据（没有时随机生成）
+    - memory: 纯内存取值池，按列类型随机生成
+    """
+    if name == "pymysql":
+        return PyMySQLBackend.for_config(mysql_config)
+    if name == "sqlite":
+        return SQLiteBackend.from_files([f"{raw_datas_dir}/schema.json", f"{raw_datas_dir}/system_table_schema.json"],
+                                        seed_path, system_vars)
+    if name == "memory":
+        return InMemoryBackend.from_schemas(list(db_schemas) + list(sys_schemas), system_vars)
+    raise ValueError(f"未知的样本后端: {name}")
+
+def parse_stage_workers(text):
+    """解析 --stage-workers 参数（如 "sample=4,comment=8"），未指定时返回 None"""
+    if not text:
+        return None
+    return {name.strip(): int(count) for name, count in (item.split("=") for item in text.split(","))}
+
+def main():
+    parser = argparse.ArgumentParser(description="合成SQL注入样本")
+    parser.add_argument("--backend", choices=["pymysql", "sqlite", "memory"], default=mysql_config.get('backend', "pymysql"),
+                        help="样本后端：MySQL，或不依赖数据库服务器的 SQLite / 内存替身")
+    parser.add_argument("--seed-rows", default=None, help="sqlite 后端的种子数据文件")
+    parser.add_argument("--llm-budget", type=float, default=None, help="LLM 花费上限，达到后停止生成；不指定时不限制")
+    parser.add_argument("--llm-rpm", type=float, default=60, help="LLM 每分钟请求数上限")
+    parser.add_argument("--llm-tpm", type=float, default=40000, help="LLM 每分钟 token 数上限")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    shard_parser = subparsers.add_parser("shard", help="生成一个分片")
+    shard_parser.add_argument("--shard-index", type=int, required=True)
+    shard_parser.add_argument("--shard-count", type=int, required=True)
+    shard_parser.add_argument("--num-examples", type=int, required=True, help="所有分片合计的样本数")
+    shard_parser.add_argument("--set", choices=["train", "test"], default="train")
+    shard_parser.add_argument("--comment-rate", type=float, default=0.3)
+    shard_parser.add_argument("--seed", type=int, default=0)
+    shard_parser.add_argument("--output-dir", default="output/shards")
+    
+    shard_parser.add_argument("--feasibility", default=feasibility_matrix_path, help="可满足性矩阵文件，不存在时不过滤")
+    shard_parser.add_argument("--stage-workers", default=None, help="各阶段线程数，如 sample=4,comment=8；不指定时顺序执行")
+    shard_parser.add_argument("--validate", choices=["parser", "explain"], default=None, help="校验生成的 SQL：sqlglot 解析或在 MySQL 上 EXPLAIN")
+    shard_parser.add_argument("--progress-interval", type=float, default=10.0, help="进度输出间隔（秒）")
+    shard_parser.add_argument("--status-file", default=None, help="JSON 状态文件，默认为 <output-dir>/<分片文件名>.status.json")
+    shard_parser.add_argument("--parquet-dir", default=None, help="同时写入的 Parquet 数据集目录（需要 pyarrow）")
+    shard_parser.add_argument("--processes", type=int, default=1, help="生成分片的工作进程数，样本取值池通过共享内存只保存一份")
+    
+    analyze_parser = subparsers.add_parser("analyze", help="检查载荷模板并生成可满足性矩阵")
+    analyze_parser.add_argument("--output", default=feasibility_matrix_path)
+    
+    profile_parser = subparsers.add_parser("profile", help="对一次生成做采样性能分析")
+    profile_parser.add_argument("--num-examples", type=int, default=50)
+    profile_parser.add_argument("--set", choices=["train", "test"], default="train")
+    profile_parser.add_argument("--comment-rate", type=float, default=0.3)
+    profile_parser.add_argument("--seed", type=int, default=0)
+    profile_parser.add_argument("--interval", type=float, default=0.005, help="采样间隔（秒）")
+    profile_parser.add_argument("--output", default="output/profile", help="输出文件前缀")
+    profile_parser.add_argument("--top", type=int, default=20, help="打印耗时最多的函数个数")
+    profile_parser.add_argument("--feasibility", default=feasibility_matrix_path, help="可满足性矩阵文件，不存在时不过滤")
+    profile_parser.add_argument("--stage-workers", default=None, help="各阶段线程数，如 sample=4,comment=8；不指定时顺序执行")
+    profile_parser.add_argument("--validate", choices=["parser", "explain"], default=None, help="校验生成的 SQL：sqlglot 解析或在 MySQL 上 EXPLAIN")
+    
+    merge_parser = subparsers.add_parser("merge", help="合并分片并检查完整性")
+    merge_parser.add_argument("--shard-dir", default="output/shards")
+    merge_parser.add_argument("--output", default="output/injection_sqls.jsonl")
+    merge_parser.add_argument("--set", choices=["train", "test"], default="train", help="分片对应的数据集，用于写出输入清单")
+    merge_parser.add_argument("--parquet-dir", default=None, help="同时导出的 Parquet 数据集目录（需要 pyarrow）")
+    
+    update_parser = subparsers.add_parser("update", help="输入变化后增量更新合并后的输出")
+    update_parser.add_argument("--output", default="output/injection_sqls.jsonl")
+    update_parser.add_argument("--set", choices=["train", "test"], default="train")
+    update_parser.add_argument("--comment-rate", type=float, default=0.3)
+    update_parser.add_argument("--seed", type=int, default=0)
+    update_parser.add_argument("--feasibility", default=feasibility_matrix_path, help="可满足性矩阵文件，不存在时不过滤")
+    update_parser.add_argument("--stage-workers", default=None, help="各阶段线程数，如 sample=4,comment=8；不指定时顺序执行")
+    update_parser.add_argument("--validate", choices=["parser", "explain"], default=None, help="校验生成的 SQL：sqlglot 解析或在 MySQL 上 EXPLAIN")
+    update_parser.add_argument("--progress-interval", type=float, default=10.0, help="进度输出间隔（秒），状态文件为 <output>.status.json")
+    
+    memcheck_parser = subparsers.add_parser("memcheck", help="检查峰值内存是否随目标样本数增长")
+    memcheck_parser.add_argument("--targets", default="10000,100000,1000000", help="逗号分隔的目标样本数")
+    memcheck_parser.add_argument("--set", choices=["train", "test"], default="train")
+    memcheck_parser.add_argument("--comment-rate", type=float, default=0.0, help="默认不调用 LLM，避免受配额限制")
+    memcheck_parser.add_argument("--max-growth", type=float, default=1.25, help="最大与最小峰值 RSS 的允许比值")
+    memcheck_parser.add_argument("--output", default="output/memcheck.json")
+    
+    args = parser.parse_args()
+    if getattr(args, "validate", None) == "explain" and args.backend != "pymysql":
+        parser.error(f"--validate explain 需要在 MySQL 上执行 EXPLAIN，不能与 --backend {args.backend} 一起使用")
+    
+    global sample_backend, llm_client
+    sample_backend = create_sample_backend(args.backend, mysql_config, args.seed_rows)
+    llm_client = RateLimitedLLMClient(gpt, model=llm_client.model, requests_per_minute=args.llm_rpm,
+                                      tokens_per_minute=args.llm_tpm, budget=args.llm_budget)
+    validator = SQLValidator(args.validate, backend=sample_backend) if getattr(args, "validate", None) else None
+    try:
+        run_command(args, validator)
+    finally:
+        # 在解释器退出前关闭校验进程池，否则 concurrent.futures 的退出清理可能报 Bad file descriptor
+        if validator is not None:
+            validator.close()
+
+def run_command(args, validator):
+    """执行 main 解析出的子命令，没有子命令时生成测试集样本示例"""
+    if args.command == "analyze":
+        issues, matrix = analyze_payload_templates(payloads, db_schemas, sys_schemas, system_vars, mysql_config)
+        for issue in issues:
+            print(f"[{issue['severity']}] #{issue['index']} {issue['message']}\n    {issue['payload']}")
+        matrix.save(args.output)
+        severities = [issue['severity'] for issue in issues]
+        print(f"共 {len(payloads)} 个模板: {severities.count('error')} 个错误, {severities.count('warning')} 个警告")
+        print(f"可满足性矩阵已写出: {args.output}")
+        return
+    
+    if args.command == "shard":
+        feasibility = FeasibilityMatrix.load(args.feasibility) if os.path.exists(args.feasibility) else None
+        selected_sqls = test_raw_sqls if args.set == "test" else train_raw_sqls
+        selected_payloads = test_payloads if args.set == "test" else train_payloads
+        stage_workers = parse_stage_workers(args.stage_workers)
+        start, end = shard_range(args.num_examples, args.shard_index, args.shard_count)
+        status_file = args.status_file or os.path.join(args.output_dir, shard_file_name(args.shard_index, args.shard_count) + ".status.json")
+        progress = ProgressReporter(end - start, args.progress_interval, status_file)
+        output_path = run_shard(args.num_examples, args.shard_index, args.shard_count, args.output_dir,
+                                selected_sqls, selected_payloads, db_schemas, sys_schemas, system_vars, args.comment_rate, args.seed, feasibility, stage_workers,
+                                validator, progress, args.parquet_dir, args.processes)
+        progress.finish()
+        print(f"分片已写出: {output_path}")
+        print(f"运行统计: {run_stats.snapshot()}")
+        print(f"LLM 用量: {llm_client.usage()}")
+        return
+    
+    if args.command == "merge":
+        selected_sqls = test_raw_sqls if args.set == "test" else train_raw_sqls
+        selected_payloads = test_payloads if args.set == "test" else train_payloads
+        report = merge_shards(args.shard_dir, args.output, selected_sqls, selected_payloads, args.parquet_dir)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if not report["complete"]:
+            raise SystemExit(1)
+        return
+    
+    if args.command == "profile":
+        feasibility = FeasibilityMatrix.load(args.feasibility) if os.path.exists(args.feasibility) else None
+        selected_sqls = test_raw_sqls if args.set == "test" else train_raw_sqls
+        selected_payloads = test_payloads if args.set == "test" else train_payloads
+        with SamplingProfiler(args.interval) as profiler:
+            examples = batch_generate_injection_sqls(args.num_examples, selected_sqls, selected_payloads, db_schemas, sys_schemas, system_vars,
+                                                     args.comment_rate, seed=args.seed, feasibility=feasibility,
+                                                     stage_workers=parse_stage_workers(args.stage_workers), validator=validator)
+        profiler.write(args.output)
+        print(f"生成 {sum(1 for example in examples if example)}/{args.num_examples} 个样本，耗时 {profiler.elapsed:.2f}s，采样 {profiler.samples} 次")
+        if pthread_getcpuclockid is None:
+            print("⚠️  当前平台无法读取线程 CPU 时间，cpu 列为 0")
+        print(f"{'wall(s)':>9} {'cpu(s)':>9} {'io(s)':>9} {'self(s)':>9}  函数")
+        for entry in profiler.summary()[:args.top]:
+            print(f"{entry['wall']:9.3f} {entry['cpu']:9.3f} {entry['io_wait']:9.3f} {entry['self_wall']:9.3f}  {entry['function']}")
+        if profiler.idle:
+            print("在流水线队列上等待（不计入上表）: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in sorted(profiler.idle.items())))
+        print(f"火焰图输入: {args.output}.wall.collapsed / {args.output}.cpu.collapsed")
+        return
+    
+    if args.command == "update":
+        feasibility = FeasibilityMatrix.load(args.feasibility) if os.path.exists(args.feasibility) else None
+        selected_sqls = test_raw_sqls if args.set == "test" else train_raw_sqls
+        selected_payloads = test_payloads if args.set == "test" else train_payloads
+        report = incremental_update(args.output, selected_sqls, selected_payloads, db_schemas, sys_schemas, system_vars,
+                                    args.comment_rate, args.seed, feasibility, parse_stage_workers(args.stage_workers), validator,
+                                    args.progress_interval)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        print(f"运行统计: {run_stats.snapshot()}")
+        print(f"LLM 用量: {llm_client.usage()}")
+        return
+    
+    if args.command == "memcheck":
+        targets = sorted(int(target) for target in args.targets.split(","))
+        results = measure_peak_memory(targets, args.backend, args.seed_rows, args.set, args.comment_rate)
+        print(f"{'样本数':>10} {'峰值RSS(MB)':>12} {'耗时(s)':>9}")
+        for entry in results:
+            print(f"{entry['target']:>10} {entry['peak_rss_mb']:>12.1f} {entry['seconds']:>9.1f}")
+        peaks = [entry['peak_rss_mb'] for entry in results]
+        growth = max(peaks) / min(peaks)
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"results": results, "growth": round(growth, 3), "max_growth": args.max_growth}, f, ensure_ascii=False, indent=2)
+        print(f"峰值内存增长 {growth:.2f}x（允许 {args.max_growth}x），报告已写出: {args.output}")
+        if growth > args.max_growth:
+            print("⚠️  峰值内存随目标样本数增长")
+            raise SystemExit(1)
+        return
+    
+    # 生成测试集注入样本
+    feasibility = FeasibilityMatrix.load(feasibility_matrix_path) if os.path.exists(feasibility_matrix_path) else None
+    progress = ProgressReporter(30, interval=2.0, status_path="output/generation_status.json")
+    if pa is not None:
+        output_path = "output/injection_sql_dataset"
+        writer = ParquetExampleWriter(output_path, test_raw_sqls, test_payloads, part_name="test_injection_sqls")
+    else:
+        output_path = "output/test_injection_sqls.jsonl"
+        writer = JsonlExampleWriter(output_path, test_raw_sqls, test_payloads)
+    
+    def _write(job):
+        if job.result:
+            writer.write(job.result)
+    
+    with writer:
+        generate_injection_sqls(30, test_raw_sqls, test_payloads, db_schemas, sys_schemas, system_vars, 0.3, _write,
+                                feasibility=feasibility, progress=progress)
+    progress.finish()
+    print(f"样本已写出: {output_path}")
+    print(f"运行统计: {run_stats.snapshot()}")
+    print(f"LLM 用量: {llm_client.usage()}")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+不依赖 MySQL 服务器的冒烟测试：用内存样本后端跑通示例生成、分片生成和合并
+
+在临时目录中为仓库顶层的数据、配置等建立链接后运行脚本，输出不会写进仓库目录。
+示例生成的 LLM 预算设为 0，测试不会真正调用 LLM。
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+SCRIPT = REPO / "generate_injection_sql.py"
+
+
+def run_script(workdir, *args):
+    result = subprocess.run([sys.executable, str(SCRIPT), "--backend", "memory", *args],
+                            cwd=workdir, capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+def make_workdir(tmp_path):
+    for entry in REPO.iterdir():
+        if entry.name not in ("output", "tests") and not entry.name.startswith("."):
+            os.symlink(entry, tmp_path / entry.name)
+    return tmp_path
+
+
+def test_demo(tmp_path):
+    workdir = make_workdir(tmp_path)
+    stdout = run_script(workdir, "--llm-budget", "0")
+    assert "样本已写出" in stdout
+    assert (workdir / "output" / "generation_status.json").exists()
+
+
+def test_shard_and_merge(tmp_path):
+    workdir = make_workdir(tmp_path)
+    num_examples = 60
+    run_script(workdir, "shard", "--shard-index", "0", "--shard-count", "2", "--num-examples", str(num_examples),
+               "--comment-rate", "0", "--output-dir", "output/shards", "--processes", "2")
+    run_script(workdir, "shard", "--shard-index", "1", "--shard-count", "2", "--num-examples", str(num_examples),
+               "--comment-rate", "0", "--output-dir", "output/shards", "--stage-workers", "sample=2")
+    stdout = run_script(workdir, "merge", "--shard-dir", "output/shards", "--output", "output/merged.jsonl")
+    report = json.loads(stdout[stdout.index("{"):])
+    assert report["complete"]
+    assert report["merged_examples"] + report["rejected_examples"] == num_examples
+
+    with open(workdir / "output" / "merged.jsonl", encoding="utf-8") as f:
+        examples = [json.loads(line) for line in f]
+    assert len(examples) == report["merged_examples"]
+    assert all(example["sql"] for example in examples)